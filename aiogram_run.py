@@ -1,9 +1,19 @@
 import asyncio
 from aiogram.types import BotCommand, BotCommandScopeDefault
-from create_bot import bot, dp, admins
+from create_bot import bot, dp, admins, webhook_settings, updates_settings
 from handlers.admin_panel import admin_router
 from handlers.user_router import user_router
-from db_handler.db_funk import get_all_users, init_db
+from db_handler.db_funk import get_user_count, event_buffer, user_buffer
+from db_handler.migrations import apply_migrations
+from db_handler.db_pool import open_pool, close_pool
+from handlers.services.events_maintenance_service import start_events_maintenance, stop_events_maintenance
+from handlers.services.settings_service import start_settings_listener, stop_settings_listener
+from middlewares.chat_order import ChatOrderMiddleware
+from middlewares.fsm_snapshot import FSMSnapshotMiddleware
+from handlers.services.message_cleanup_service import wait_pending_deletes
+from handlers.services.assets_service import load_assets
+from handlers.services.webhook_service import run_webhook
+from handlers.services.broadcast_service import resume_broadcasts, stop_broadcasts
 
 
 # Функция, которая настроит командное меню (дефолтное для всех пользователей)
@@ -16,12 +26,26 @@ async def set_commands():
 
 # Функция, которая выполнится когда бот запустится
 async def start_bot():
-    # создаём таблицы, команды, уведомляем админов
-    await init_db()
+    # открываем общий пул соединений, догоняем схему миграциями, команды, уведомляем админов
+    await open_pool()
+    # при актуальной схеме — одно чтение schema_version, без DDL
+    await apply_migrations()
+    # настройки бота в память + подписка на их изменения (LISTEN/NOTIFY)
+    await start_settings_listener()
+    # file_id статичных картинок экранов
+    await load_assets()
+    # секции user_events вперёд и удаление секций за пределами срока хранения
+    start_events_maintenance()
+    # фоновая пакетная запись событий аналитики
+    event_buffer.start()
+    # пакетная запись новых/изменённых профилей пользователей (/start)
+    user_buffer.start()
     # подключаем командное меню (/start, /profile, /help)
     await set_commands()
+    # незавершённые рассылки продолжаются с неотправленных получателей
+    await resume_broadcasts(bot)
     try:
-        count_users = await get_all_users(count=True)
+        count_users = await get_user_count()
         for admin_id in admins:
             await bot.send_message(admin_id, f'Я запущен. <b>{count_users}</b> пользователей.')
     except Exception:
@@ -34,9 +58,24 @@ async def stop_bot():
             await bot.send_message(admin_id, 'Кажется я всё... Пока!')
     except Exception:
         pass
+    # дописываем статусы начатых пачек рассылки, сама рассылка продолжится после запуска
+    await stop_broadcasts()
+    # даём фоновым удалениям сообщений завершиться
+    await wait_pending_deletes()
+    # дописываем буфер событий и закрываем пул соединений с базой данных
+    await stop_settings_listener()
+    await stop_events_maintenance()
+    await event_buffer.stop()
+    await user_buffer.stop()
+    await close_pool()
 
 
 async def main():
+    # обновления одного чата — по очереди, разных — параллельно (первым: снимок FSM читается уже в очереди чата)
+    dp.update.outer_middleware(ChatOrderMiddleware(**updates_settings))
+    # FSM-данные: одно чтение и одна запись на обновление
+    dp.update.outer_middleware(FSMSnapshotMiddleware())
+
     # регистрация роутеров
     dp.include_router(user_router)
     dp.include_router(admin_router)
@@ -45,10 +84,14 @@ async def main():
     dp.startup.register(start_bot)
     dp.shutdown.register(stop_bot)
 
-    # запуск бота в режиме long polling при запуске бот очищает все обновления, которые были за его моменты бездействия
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if webhook_settings["mode"] == "webhook":
+            # приём обновлений вебхуком (BOT_MODE=webhook), см. handlers/services/webhook_service.py
+            await run_webhook(dp, bot)
+        else:
+            # запуск бота в режиме long polling при запуске бот очищает все обновления, которые были за его моменты бездействия
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
         await bot.session.close()
 
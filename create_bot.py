@@ -2,8 +2,9 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from asyncpg_lite import DatabaseManager
+from aiogram.fsm.storage.memory import MemoryStorage
 from decouple import config
+from middlewares.rate_limit import RateLimitMiddleware
 
 
 
@@ -14,16 +15,111 @@ admins = [int(a.strip()) for a in config('ADMINS', default='').split(',') if a.s
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Иициируем объект, который будет отвечать за взаимодействие с базой данных
-db_manager = DatabaseManager(
-    db_url=config('PG_LINK'),
-    deletion_password=config('ROOT_PASS')
-)
+# Строка подключения и параметры общего пула соединений с базой данных
+pg_link = config('PG_LINK')
+db_pool_settings = {
+    'pool_size': config('DB_POOL_SIZE', default=5, cast=int),
+    'max_overflow': config('DB_POOL_MAX_OVERFLOW', default=10, cast=int),
+    'pool_recycle': config('DB_POOL_RECYCLE', default=1800, cast=int),
+    'pool_timeout': config('DB_POOL_TIMEOUT', default=30, cast=int),
+}
+
+# Параметры буфера аналитических событий (пакетная запись user_events)
+events_buffer_settings = {
+    'batch_size': config('EVENTS_FLUSH_SIZE', default=500, cast=int),
+    'flush_interval': config('EVENTS_FLUSH_INTERVAL', default=2.0, cast=float),
+    'max_size': config('EVENTS_BUFFER_MAX', default=20000, cast=int),
+}
+
+# Индекс известных пользователей (пропуск повторной записи на /start) и пакетная запись изменённых профилей
+known_users_settings = {
+    'max_size': config('KNOWN_USERS_MAX', default=100000, cast=int),
+    'batch_size': config('USERS_FLUSH_SIZE', default=200, cast=int),
+    'flush_interval': config('USERS_FLUSH_INTERVAL', default=2.0, cast=float),
+}
+
+# Кэш кейсов для публичных экранов: сколько кейсов держать и сколько секунд
+case_cache_settings = {
+    'max_size': config('CASE_CACHE_SIZE', default=256, cast=int),
+    'ttl': config('CASE_CACHE_TTL', default=300, cast=float),
+}
+
+# Секционирование user_events: шаг (month/week/day), запас секций вперёд, срок хранения и период проверки
+events_partition_settings = {
+    'interval': config('EVENTS_PARTITION_INTERVAL', default='month'),
+    'ahead': config('EVENTS_PARTITIONS_AHEAD', default=2, cast=int),
+    'retention_days': config('EVENTS_RETENTION_DAYS', default=365, cast=int),
+    'check_hours': config('EVENTS_PARTITION_CHECK_HOURS', default=6, cast=float),
+}
+
+# Режим получения обновлений: polling (getUpdates) или webhook (встроенный aiohttp-сервер за обратным прокси)
+webhook_settings = {
+    'mode': config('BOT_MODE', default='polling'),
+    'url': config('WEBHOOK_URL', default=''),
+    'path': config('WEBHOOK_PATH', default='/webhook'),
+    'secret': config('WEBHOOK_SECRET', default=''),
+    'host': config('WEBHOOK_HOST', default='0.0.0.0'),
+    'port': config('WEBHOOK_PORT', default=8080, cast=int),
+    'max_in_flight': config('WEBHOOK_MAX_IN_FLIGHT', default=100, cast=int),
+    'drain_timeout': config('WEBHOOK_DRAIN_TIMEOUT', default=25, cast=float),
+    'set_webhook': config('WEBHOOK_SET', default=True, cast=bool),
+    'drop_pending': config('WEBHOOK_DROP_PENDING', default=False, cast=bool),
+}
+# без секрета любой, кто достучится до порта, может прислать поддельное обновление (в т.ч. от имени админа)
+if webhook_settings['mode'] == 'webhook' and not webhook_settings['secret']:
+    raise RuntimeError("BOT_MODE=webhook requires a non-empty WEBHOOK_SECRET")
+
+# Лимиты исходящих сообщений: на весь бот (в сек), на личный чат и на группу (в сек, с запасом подряд), повторы после flood-ошибки.
+# Запас личного чата вмещает целый экран (альбом, отзыв из нескольких сообщений, карточка) — жёсткий предел нужен группам
+rate_limit_settings = {
+    'global_rate': config('RATE_LIMIT_GLOBAL', default=25.0, cast=float),
+    'chat_rate': config('RATE_LIMIT_CHAT', default=1.0, cast=float),
+    'chat_burst': config('RATE_LIMIT_CHAT_BURST', default=10.0, cast=float),
+    'group_rate': config('RATE_LIMIT_GROUP', default=0.33, cast=float),
+    'group_burst': config('RATE_LIMIT_GROUP_BURST', default=3.0, cast=float),
+    'max_retries': config('RATE_LIMIT_MAX_RETRIES', default=3, cast=int),
+}
+
+# Рассылки: скорость (сообщений в сек, ниже RATE_LIMIT_GLOBAL — чтобы бот отвечал остальным), размер пачки получателей,
+# период обновления прогресса (сек), продолжение незавершённых рассылок после перезапуска (только в одном процессе)
+broadcast_settings = {
+    'rate': config('BROADCAST_RATE', default=20.0, cast=float),
+    'chunk_size': config('BROADCAST_CHUNK', default=500, cast=int),
+    'progress_interval': config('BROADCAST_PROGRESS_INTERVAL', default=3.0, cast=float),
+    'resume': config('BROADCAST_RESUME', default=True, cast=bool),
+}
 
 # Инициируем объект бота, передавая ему parse_mode=ParseMode.HTML по умолчанию
 bot = Bot(token=config('TOKEN'), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+# все исходящие сообщения идут через общий и початовый лимит (middlewares/rate_limit.py)
+bot.session.middleware(RateLimitMiddleware(**rate_limit_settings))
+
+# Обработка обновлений: одного чата — по очереди, разных — параллельно, не больше max_concurrency одновременно
+updates_settings = {
+    'max_concurrency': config('UPDATES_MAX_CONCURRENCY', default=50, cast=int),
+}
+
+# FSM-хранилище: pg — в Postgres с пакетной записью (переживает перезапуск), memory — в памяти процесса
+fsm_storage_settings = {
+    'backend': config('FSM_STORAGE', default='pg'),
+    'flush_interval': config('FSM_FLUSH_INTERVAL', default=1.0, cast=float),
+    'cache_size': config('FSM_CACHE_SIZE', default=10000, cast=int),
+    # сколько секунд копия в памяти считается актуальной; несколько процессов бота — 0
+    'cache_ttl': config('FSM_CACHE_TTL', default=5.0, cast=float),
+}
+
+if fsm_storage_settings['backend'] == 'memory':
+    storage = MemoryStorage()
+else:
+    # импорт после настроек выше: db_handler.db_pool читает их из этого модуля
+    from db_handler.fsm_storage import PgStorage
+    storage = PgStorage(
+        flush_interval=fsm_storage_settings['flush_interval'],
+        cache_size=fsm_storage_settings['cache_size'],
+        cache_ttl=fsm_storage_settings['cache_ttl'],
+    )
 
 # Инициируем объект бота
-dp = Dispatcher()
+dp = Dispatcher(storage=storage)
 
 
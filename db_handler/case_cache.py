@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Кэш в памяти процесса: не больше max_size записей (вытесняются давно не читанные)
+    и не дольше ttl секунд на запись.
+    invalidate() сдвигает поколение ключа: значение, загруженное до инвалидации,
+    уже не попадёт в кэш (см. generation()/set()).
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = 300.0):
+        self.max_size = max(int(max_size), 1)
+        self.ttl = float(ttl)
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._generations: Dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def generation(self, key: Hashable) -> int:
+        return self._generations.get(key, 0)
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        if generation is not None and generation != self.generation(key):
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+        self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self) -> None:
+        for key in list(self._data):
+            self.invalidate(key)
@@ -1,190 +1,163 @@
-from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
 import json
-from create_bot import db_manager
+import re
+import time
+from create_bot import events_buffer_settings, events_partition_settings, case_cache_settings, known_users_settings
+from db_handler.db_pool import db_session
+from db_handler.event_buffer import EventBuffer
+from db_handler.case_cache import LRUCache
+from db_handler.known_users import KnownUsers
 from sqlalchemy import BigInteger, String, TIMESTAMP, text
 
 USERS_TABLE = 'users_reg'
 CASES_TABLE = 'cases'
 IMAGES_TABLE = 'case_images'
 EVENTS_TABLE = 'user_events'
+EVENTS_DAILY_TABLE = 'user_events_daily'
+EVENTS_DAILY_USERS_TABLE = 'user_events_daily_users'
+EVENTS_DAILY_CASES_TABLE = 'user_events_daily_cases'
+CASE_EVENT_TYPES = ('case_view', 'review_open', 'cta_click', 'case_contact_click')
+BROADCASTS_TABLE = 'broadcasts'
+BROADCAST_RECIPIENTS_TABLE = 'broadcast_recipients'
+# Канал NOTIFY об изменении bot_settings (слушает handlers/services/settings_service.py)
+SETTINGS_CHANNEL = 'bot_settings_changed'
 
+# Кэш кейсов для публичных экранов (см. get_case_bundle_cached)
+case_bundle_cache = LRUCache(**case_cache_settings)
 
-# Создаём таблицу users_reg, если её ещё нет
-async def init_db() -> None:
-    users_sql = f"""
-    CREATE TABLE IF NOT EXISTS {USERS_TABLE} (
-        user_id   BIGINT PRIMARY KEY,
-        full_name VARCHAR(255),
-        user_login VARCHAR(255),
-        date_reg  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """
-
-    cases_sql = f"""
-    CREATE TABLE IF NOT EXISTS {CASES_TABLE} (
-        case_id        BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
-        title          VARCHAR(255)  NOT NULL,
-        description    VARCHAR(2000) NOT NULL,
-
-        status         VARCHAR(20) NOT NULL DEFAULT 'draft',
-        sort_order     INT NOT NULL DEFAULT 0,
-
-        created     TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-        updated     TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-
-        CHECK (status IN ('draft', 'published', 'archived'))
-    );
-    """
-
-    images_sql = f"""
-    CREATE TABLE IF NOT EXISTS {IMAGES_TABLE} (
-        image_id       BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
-        case_id        BIGINT NOT NULL REFERENCES cases(case_id) ON DELETE CASCADE,
-
-        tg_file_id     VARCHAR(300) NOT NULL,
-        media_type    VARCHAR(10) NOT NULL DEFAULT 'photo',
-
-        position       INT NOT NULL DEFAULT 0,
-        is_cover       BOOLEAN NOT NULL DEFAULT FALSE,
-
-        created     TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-    );
-    """
-
-    images_idx1_sql = f"""
-    CREATE INDEX IF NOT EXISTS idx_case_images_case_id
-    ON {IMAGES_TABLE}(case_id);
-    """
-
-    images_idx2_sql = f"""
-    CREATE INDEX IF NOT EXISTS idx_case_images_position
-    ON {IMAGES_TABLE}(case_id, position);
-    """
-
-    events_sql = f"""
-    CREATE TABLE IF NOT EXISTS {EVENTS_TABLE} (
-        event_id        BIGSERIAL PRIMARY KEY,
-        user_id         BIGINT NOT NULL,
-        event_type      VARCHAR(64) NOT NULL,
-        event_context   VARCHAR(64),
-        event_value     VARCHAR(128),
-        payload         JSONB,
-        created_at      TIMESTAMP NOT NULL DEFAULT NOW()
-    );
-    """
-
-    events_idx_user_sql = f"""
-    CREATE INDEX IF NOT EXISTS idx_user_events_user_id
-    ON {EVENTS_TABLE}(user_id);
-    """
 
-    events_idx_type_sql = f"""
-    CREATE INDEX IF NOT EXISTS idx_user_events_event_type
-    ON {EVENTS_TABLE}(event_type);
-    """
+# ------------------------------------------------------------------------ Секционирование user_events ------------------------------------------------------------
 
-    events_idx_created_sql = f"""
-    CREATE INDEX IF NOT EXISTS idx_user_events_created_at
-    ON {EVENTS_TABLE}(created_at);
-    """
+EVENTS_DEFAULT_PARTITION = f"{EVENTS_TABLE}_default"
+_PARTITION_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
 
-    reviews_sql = """
-    CREATE TABLE IF NOT EXISTS case_reviews (
-        review_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
-        case_id BIGINT NOT NULL UNIQUE REFERENCES cases(case_id) ON DELETE CASCADE,
-        created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-        updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-    );
-    """
 
-    review_items_sql = """
-    CREATE TABLE IF NOT EXISTS case_review_items (
-        item_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
-        review_id BIGINT NOT NULL REFERENCES case_reviews(review_id) ON DELETE CASCADE,
-        tg_file_id VARCHAR(300),
-        media_type VARCHAR(20) NOT NULL,
-        text_content VARCHAR(4000),
-        position INT NOT NULL DEFAULT 0,
-        created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-    );
-    """
+def _partition_start(ts: datetime, interval: str) -> datetime:
+    if interval == "day":
+        return datetime(ts.year, ts.month, ts.day)
+    if interval == "week":
+        monday = ts.date() - timedelta(days=ts.weekday())
+        return datetime(monday.year, monday.month, monday.day)
+    return datetime(ts.year, ts.month, 1)
 
-    review_idx_sql = """
-    CREATE INDEX IF NOT EXISTS idx_case_reviews_case_id
-    ON case_reviews(case_id);
-    """
 
-    review_items_idx_sql = """
-    CREATE INDEX IF NOT EXISTS idx_case_review_items_review_id_position
-    ON case_review_items(review_id, position);
-    """
+def _partition_next(start: datetime, interval: str) -> datetime:
+    if interval == "day":
+        return start + timedelta(days=1)
+    if interval == "week":
+        return start + timedelta(days=7)
+    if start.month == 12:
+        return datetime(start.year + 1, 1, 1)
+    return datetime(start.year, start.month + 1, 1)
 
-    cta_sql = """
-    CREATE TABLE IF NOT EXISTS case_cta (
-        case_id BIGINT PRIMARY KEY REFERENCES cases(case_id) ON DELETE CASCADE,
-        button_text VARCHAR(64) NOT NULL DEFAULT 'Связаться со мной',
-        action_type VARCHAR(16) NOT NULL DEFAULT 'contact',
-        action_value VARCHAR(255),
-        updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-    );
-    """
 
-    settings_sql = """
-    CREATE TABLE IF NOT EXISTS bot_settings (
-        key TEXT PRIMARY KEY,
-        value TEXT,
-        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-    );
-    """
-    async with db_manager as client:
-        # Открываем ассинхронную сессию
-        async with client.session() as session:
-            await session.execute(text(users_sql))
-            await session.execute(text(cases_sql))
-            await session.execute(text(images_sql))
-            await session.execute(text(events_sql))
-            await session.execute(text(reviews_sql))
-            await session.execute(text(review_items_sql))
-            await session.execute(text(review_idx_sql))
-            await session.execute(text(review_items_idx_sql))
-            await session.execute(text(cta_sql))
-            await session.execute(text(settings_sql))
-            await session.execute(text(
-                f"ALTER TABLE {IMAGES_TABLE} "
-                "ADD COLUMN IF NOT EXISTS media_type VARCHAR(10) NOT NULL DEFAULT 'photo';"
-            ))
-            await session.execute(text(images_idx1_sql))
-            await session.execute(text(images_idx2_sql))
-            await session.execute(text(events_idx_user_sql))
-            await session.execute(text(events_idx_type_sql))
-            await session.execute(text(events_idx_created_sql))
-            await session.commit()
-
-
-# Обёртка для вызова init_db — создаём таблицы
-async def create_tables() -> None:
-    await init_db()
+async def _get_event_partitions(session, table_name: str = EVENTS_TABLE) -> List[Tuple[str, datetime, datetime]]:
+    sql = text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table_name);
+    """)
+    res = await session.execute(sql, {"table_name": table_name})
+    partitions: List[Tuple[str, datetime, datetime]] = []
+    for name, bound in res.fetchall():
+        match = _PARTITION_BOUND_RE.search(bound or "")
+        if not match:
+            continue  # DEFAULT-секция
+        partitions.append((name, datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))))
+    return partitions
+
+
+async def create_event_partitions(session, from_ts: datetime, table_name: str = EVENTS_TABLE) -> List[str]:
+    interval = events_partition_settings["interval"]
+    now_res = await session.execute(text("SELECT LOCALTIMESTAMP;"))
+    now_ts = now_res.scalar_one()
+
+    existing = await _get_event_partitions(session, table_name)
+    start = _partition_start(min(from_ts, now_ts), interval)
+    until = _partition_next(_partition_start(now_ts, interval), interval)
+    # хотя бы одна секция вперёд: иначе события нового периода успевают лечь в DEFAULT,
+    # и CREATE ... PARTITION OF на этот диапазон потом падает на пересекающихся строках
+    for _ in range(max(int(events_partition_settings["ahead"]), 1)):
+        until = _partition_next(until, interval)
+
+    created: List[str] = []
+    while start < until:
+        end = _partition_next(start, interval)
+        # пропускаем диапазоны, которые уже покрыты (в т.ч. секциями с другим шагом)
+        if not any(p_start < end and start < p_end for _, p_start, p_end in existing):
+            name = f"{table_name}_p{start:%Y%m%d}"
+            await session.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {name}
+                PARTITION OF {table_name}
+                FOR VALUES FROM ('{start:%Y-%m-%d %H:%M:%S}') TO ('{end:%Y-%m-%d %H:%M:%S}');
+            """))
+            existing.append((name, start, end))
+            created.append(name)
+        start = end
+    return created
+
+
+# Создаём секции user_events на текущий период и на EVENTS_PARTITIONS_AHEAD периодов вперёд
+async def ensure_event_partitions(table_name: str = EVENTS_TABLE) -> List[str]:
+    async with db_session() as session:
+        created = await create_event_partitions(session, datetime.now(), table_name)
+        await session.commit()
+        return created
+
+
+# Удаляем секции, целиком вышедшие за окно хранения: DROP TABLE секции вместо построчного DELETE
+async def drop_expired_event_partitions(
+    retention_days: Optional[int] = None,
+    table_name: str = EVENTS_TABLE
+) -> List[str]:
+    if retention_days is None:
+        retention_days = int(events_partition_settings["retention_days"])
+    if retention_days <= 0:
+        return []
+
+    async with db_session() as session:
+        now_res = await session.execute(text("SELECT LOCALTIMESTAMP;"))
+        cutoff = now_res.scalar_one() - timedelta(days=retention_days)
+        dropped: List[str] = []
+        for name, _, p_end in await _get_event_partitions(session, table_name):
+            if p_end <= cutoff:
+                await session.execute(text(f"DROP TABLE IF EXISTS {name};"))
+                dropped.append(name)
+        await session.commit()
+        return dropped
 
 
 # Получаем данные конкретного пользователя по user_id
 async def get_user_data(user_id: int, table_name: str = USERS_TABLE) -> Optional[Dict[str, Any]]:
-    async with db_manager as client:
-        return await client.select_data(
-            table_name=table_name,
-            where_dict={'user_id': user_id},
-            one_dict=True
-        )
+    sql = text(f"""
+        SELECT user_id, full_name, user_login, date_reg
+        FROM {table_name}
+        WHERE user_id = :user_id;
+    """)
+    async with db_session() as session:
+        res = await session.execute(sql, {"user_id": user_id})
+        row = res.fetchone()
+        return dict(row._mapping) if row else None
 
 
 async def get_setting(key: str, default: str | None = None) -> str | None:
     sql = text("SELECT value FROM bot_settings WHERE key = :key;")
-    async with db_manager as client:
-        async with client.session() as session:
-            res = await session.execute(sql, {"key": key})
-            value = res.scalar_one_or_none()
-            return value if value is not None else default
+    async with db_session() as session:
+        res = await session.execute(sql, {"key": key})
+        value = res.scalar_one_or_none()
+        return value if value is not None else default
+
+
+async def get_all_settings() -> Dict[str, str]:
+    sql = text("SELECT key, value FROM bot_settings;")
+    async with db_session() as session:
+        res = await session.execute(sql)
+        return {row.key: row.value for row in res.fetchall() if row.value is not None}
 
 
+# Сохраняем настройку и в той же транзакции шлём NOTIFY: процессы бота получат его после COMMIT
 async def set_setting(key: str, value: str) -> None:
     sql = text("""
         INSERT INTO bot_settings (key, value, updated_at)
@@ -192,39 +165,83 @@ async def set_setting(key: str, value: str) -> None:
         ON CONFLICT (key)
         DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            await session.execute(sql, {"key": key, "value": value})
-            await session.commit()
+    notify_sql = text("SELECT pg_notify(:channel, json_build_object('key', CAST(:key AS TEXT), 'value', CAST(:value AS TEXT))::text);")
+    async with db_session() as session:
+        await session.execute(sql, {"key": key, "value": value})
+        await session.execute(notify_sql, {"channel": SETTINGS_CHANNEL, "key": key, "value": value})
+        await session.commit()
+
+
+# file_id загруженных в Telegram статичных картинок по хэшу содержимого (см. assets_service)
+async def get_static_assets() -> Dict[str, str]:
+    sql = text("SELECT content_hash, file_id FROM static_assets;")
+    async with db_session() as session:
+        res = await session.execute(sql)
+        return {row.content_hash: row.file_id for row in res.fetchall()}
+
+
+async def upsert_static_asset(content_hash: str, path: str, file_id: str) -> None:
+    sql = text("""
+        INSERT INTO static_assets (content_hash, path, file_id, updated_at)
+        VALUES (:content_hash, :path, :file_id, CURRENT_TIMESTAMP)
+        ON CONFLICT (content_hash)
+        DO UPDATE SET path = EXCLUDED.path, file_id = EXCLUDED.file_id, updated_at = CURRENT_TIMESTAMP;
+    """)
+    async with db_session() as session:
+        await session.execute(sql, {"content_hash": content_hash, "path": path, "file_id": file_id})
+        await session.commit()
+
+
+async def delete_static_asset(content_hash: str) -> None:
+    sql = text("DELETE FROM static_assets WHERE content_hash = :content_hash;")
+    async with db_session() as session:
+        await session.execute(sql, {"content_hash": content_hash})
+        await session.commit()
 
 
 async def db_ping() -> bool:
     sql = text("SELECT 1;")
     try:
-        async with db_manager as client:
-            async with client.session() as session:
-                await session.execute(sql)
+        async with db_session() as session:
+            await session.execute(sql)
         return True
     except Exception:
         return False
 
 
-# Возвращаем список всех пользователей или только их количество
+# Возвращаем список всех пользователей или только их количество (количество — через COUNT(*), без выборки строк).
+# Для обхода всей аудитории используйте iter_users — он не держит всех пользователей в памяти
 async def get_all_users(table_name: str = USERS_TABLE, count: bool = False):
-    async with db_manager as client:
-        all_users: List[Dict[str, Any]] = await client.select_data(table_name=table_name)
-        if count:
-            return len(all_users)
-        return all_users
-    
-    
+    if count:
+        return await get_user_count(table_name=table_name)
+    sql = text(f"SELECT user_id, full_name, user_login, date_reg FROM {table_name};")
+    async with db_session() as session:
+        res = await session.execute(sql)
+        return [dict(r._mapping) for r in res.fetchall()]
+
+
+# Потоково отдаём пользователей пачками по chunk_size через серверный курсор
+async def iter_users(
+    chunk_size: int = 1000,
+    table_name: str = USERS_TABLE
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    sql = text(f"""
+        SELECT user_id, full_name, user_login, date_reg
+        FROM {table_name}
+        ORDER BY user_id;
+    """).execution_options(yield_per=max(int(chunk_size), 1))
+    async with db_session() as session:
+        result = await session.stream(sql)
+        async for partition in result.partitions():
+            yield [dict(r._mapping) for r in partition]
+
+
 async def get_user_count(table_name: str = USERS_TABLE) -> int:
     sql = text(f"SELECT COUNT(*) FROM {table_name};")
 
-    async with db_manager as client:
-        async with client.session() as session:
-            result = await session.execute(sql)
-            return int(result.scalar_one())
+    async with db_session() as session:
+        result = await session.execute(sql)
+        return int(result.scalar_one())
 
 
 async def get_cases_count(status: Optional[str] = None, table_name: str = CASES_TABLE) -> int:
@@ -236,55 +253,223 @@ async def get_cases_count(status: Optional[str] = None, table_name: str = CASES_
 
     sql = text(f"SELECT COUNT(*) FROM {table_name} {where_sql};")
 
-    async with db_manager as client:
-        async with client.session() as session:
-            result = await session.execute(sql, params)
-            return int(result.scalar_one())
+    async with db_session() as session:
+        result = await session.execute(sql, params)
+        return int(result.scalar_one())
 
 
 async def get_case_media_count(table_name: str = IMAGES_TABLE) -> int:
     sql = text(f"SELECT COUNT(*) FROM {table_name};")
 
-    async with db_manager as client:
-        async with client.session() as session:
-            result = await session.execute(sql)
-            return int(result.scalar_one())
+    async with db_session() as session:
+        result = await session.execute(sql)
+        return int(result.scalar_one())
+
+# Все скалярные счётчики отчёта статистики одним запросом
+async def get_overview_counts(days: int = 30) -> Dict[str, int]:
+    sql = text(f"""
+        SELECT
+            (SELECT COUNT(*) FROM {USERS_TABLE}) AS users_total,
+            c.cases_total,
+            c.cases_published,
+            c.cases_draft,
+            c.cases_archived,
+            (SELECT COUNT(*) FROM {IMAGES_TABLE}) AS media_total,
+            (
+                SELECT COALESCE(SUM(cnt), 0)::BIGINT
+                FROM {EVENTS_DAILY_TABLE}
+                WHERE day >= CURRENT_DATE - CAST(:days AS INTEGER)
+            ) AS events_total
+        FROM (
+            SELECT
+                COUNT(*) AS cases_total,
+                COUNT(*) FILTER (WHERE status = 'published') AS cases_published,
+                COUNT(*) FILTER (WHERE status = 'draft') AS cases_draft,
+                COUNT(*) FILTER (WHERE status = 'archived') AS cases_archived
+            FROM {CASES_TABLE}
+        ) c;
+    """)
+    async with db_session() as session:
+        res = await session.execute(sql, {"days": days})
+        row = res.fetchone()
+        return {key: int(value or 0) for key, value in row._mapping.items()}
+
 
 # Добавляем пользователя в таблицу или обновляем данные, если такой user_id уже есть
 async def insert_user(user_data: Dict[str, Any], table_name: str = USERS_TABLE) -> None:
-    async with db_manager as client:
-        await client.insert_data_with_update(
-            table_name=table_name,
-            records_data=user_data,
-            conflict_column='user_id',
-            update_on_conflict=True
-        )
+    sql = text(f"""
+        INSERT INTO {table_name} (user_id, full_name, user_login)
+        VALUES (:user_id, :full_name, :user_login)
+        ON CONFLICT (user_id)
+        DO UPDATE SET
+            full_name = EXCLUDED.full_name,
+            user_login = EXCLUDED.user_login;
+    """)
+    async with db_session() as session:
+        await session.execute(sql, {
+            "user_id": user_data["user_id"],
+            "full_name": user_data.get("full_name"),
+            "user_login": user_data.get("user_login")
+        })
+        await session.commit()
+
+
+# Пакетный upsert профилей: по одной строке на user_id (последняя версия), неизменённые строки не переписываем
+async def upsert_users_bulk(users: List[Dict[str, Any]], table_name: str = USERS_TABLE) -> None:
+    latest: Dict[int, Dict[str, Any]] = {}
+    for user in users:
+        latest[user["user_id"]] = user
+    if not latest:
+        return
+    rows = list(latest.values())
+    sql = text(f"""
+        INSERT INTO {table_name} AS u (user_id, full_name, user_login, last_activity)
+        SELECT t.user_id, t.full_name, t.user_login, LOCALTIMESTAMP
+        FROM unnest(
+            CAST(:user_ids AS BIGINT[]),
+            CAST(:full_names AS VARCHAR[]),
+            CAST(:user_logins AS VARCHAR[])
+        ) AS t(user_id, full_name, user_login)
+        ON CONFLICT (user_id)
+        DO UPDATE SET
+            full_name = EXCLUDED.full_name,
+            user_login = EXCLUDED.user_login
+        WHERE u.full_name IS DISTINCT FROM EXCLUDED.full_name
+           OR u.user_login IS DISTINCT FROM EXCLUDED.user_login;
+    """)
+    async with db_session() as session:
+        await session.execute(sql, {
+            "user_ids": [r["user_id"] for r in rows],
+            "full_names": [r.get("full_name") for r in rows],
+            "user_logins": [r.get("user_login") for r in rows],
+        })
+        await session.commit()
+
+
+# Профили самых активных пользователей для прогрева known_users
+async def load_known_user_profiles(limit: int, table_name: str = USERS_TABLE) -> List[Tuple[int, Optional[str], Optional[str]]]:
+    sql = text(f"""
+        SELECT user_id, full_name, user_login
+        FROM {table_name}
+        ORDER BY last_activity DESC NULLS LAST
+        LIMIT :limit;
+    """)
+    async with db_session() as session:
+        res = await session.execute(sql, {"limit": limit})
+        return [tuple(row) for row in res.fetchall()]
+
+
+known_users = KnownUsers(load_func=load_known_user_profiles, max_size=known_users_settings["max_size"])
+
+
+async def _flush_users(batch: List[Dict[str, Any]]) -> None:
+    try:
+        await upsert_users_bulk(batch)
+    except Exception:
+        # профиль не записан — при следующем /start пользователь снова попадёт в очередь
+        for user in batch:
+            known_users.forget(user["user_id"])
+        raise
+
+
+# Очередь изменённых профилей: пишется пачками в фоне тем же механизмом, что и события
+user_buffer = EventBuffer(
+    flush_func=_flush_users,
+    batch_size=known_users_settings["batch_size"],
+    flush_interval=known_users_settings["flush_interval"],
+)
+
+
+# Регистрируем пользователя на /start: без записи, если профиль уже известен и не менялся
+async def register_user(user_data: Dict[str, Any]) -> bool:
+    known_users.ensure_loaded()
+    user_id = user_data["user_id"]
+    profile_hash = KnownUsers.profile_hash(user_data)
+    if known_users.is_current(user_id, profile_hash):
+        return False
+    known_users.remember(user_id, profile_hash)
+    user_buffer.add(dict(user_data))
+    return True
 
 
 ALLOWED_CASE_FIELDS = {"title", "description", "status", "sort_order"}
+# Колонки и типы для bulk_insert
+CASE_MEDIA_COLUMNS = {"case_id": "BIGINT", "tg_file_id": "VARCHAR", "position": "INT", "is_cover": "BOOLEAN"}
+REVIEW_ITEM_COLUMNS = {"review_id": "BIGINT", "tg_file_id": "VARCHAR", "media_type": "VARCHAR", "text_content": "VARCHAR", "position": "INT"}
+
+
+# ------------------------------------------------------------------------ Keyset-пагинация кейсов ---------------------------------------------------------------
+# Курсор страницы живёт в callback_data (лимит 64 байта), поэтому он короткий и без ":" и "|":
+#   ""            — первая страница
+#   "n<ключ>"     — строки строго после ключа (кнопка «Вперёд»)
+#   "p<ключ>"     — строки строго перед ключом (кнопка «Назад»)
+#   "s<ключ>"     — строки начиная с ключа включительно (возврат к той же странице)
+# ключ — sort_order, created (микросекунды) и case_id в base36 через точку.
+
+_CURSOR_EPOCH = datetime(1970, 1, 1)
+_CASES_ORDER_FWD = "ORDER BY sort_order ASC, created DESC, case_id DESC"
+_CASES_ORDER_REV = "ORDER BY sort_order DESC, created ASC, case_id ASC"
+# Первое условие избыточно, но даёт планировщику начало диапазона в индексе
+# (idx_cases_status_order / idx_cases_order) — без него глубокие страницы читают индекс с начала
+_CASES_KEY_CONDITIONS = {
+    "n": "sort_order >= :so AND (sort_order > :so OR (sort_order = :so AND (created < :cr OR (created = :cr AND case_id < :cid))))",
+    "s": "sort_order >= :so AND (sort_order > :so OR (sort_order = :so AND (created < :cr OR (created = :cr AND case_id <= :cid))))",
+    "p": "sort_order <= :so AND (sort_order < :so OR (sort_order = :so AND (created > :cr OR (created = :cr AND case_id > :cid))))",
+}
+
+
+def _to_base36(value: int) -> str:
+    sign = "-" if value < 0 else ""
+    value = abs(value)
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        value, rem = divmod(value, 36)
+        out = digits[rem] + out
+        if not value:
+            return sign + out
+
+
+def encode_case_cursor(kind: str, row: Dict[str, Any]) -> str:
+    created_us = (row["created"] - _CURSOR_EPOCH) // timedelta(microseconds=1)
+    return kind + ".".join(_to_base36(int(v)) for v in (row["sort_order"], created_us, row["case_id"]))
+
+
+def _decode_case_cursor(cursor: Optional[str]) -> Optional[Tuple[str, int, datetime, int]]:
+    if not cursor or cursor[0] not in _CASES_KEY_CONDITIONS:
+        return None
+    try:
+        sort_order, created_us, case_id = (int(part, 36) for part in cursor[1:].split("."))
+    except ValueError:
+        return None
+    return cursor[0], sort_order, _CURSOR_EPOCH + timedelta(microseconds=created_us), case_id
 
 
 async def get_cases_page(
-    page: int = 0,
-    limit: int = 6,
+    cursor: Optional[str] = None,
+    limit: int = 8,
     table_name: str = CASES_TABLE,
     status: Optional[str] = None,
-) -> List[Dict[str, Any]]:
-    
-     # защита от мусора
-    page = max(int(page), 0)
+) -> Dict[str, Any]:
+    """
+    Страница кейсов по курсору (см. описание формата выше).
+    Возвращает items и курсоры: cursor — текущей страницы, prev_cursor/next_cursor —
+    соседних страниц (None, если их нет). Некорректный курсор даёт первую страницу.
+    """
     limit = max(int(limit), 1)
+    key = _decode_case_cursor(cursor)
 
-    page_size = (limit - 1) if limit > 1 else limit
-    offset = page * page_size
-
-    where_sql = ""
-    params = {"limit": limit, "offset": offset}
-
+    conditions: List[str] = []
+    params: Dict[str, Any] = {"limit": limit + 1}
     if status:
-        where_sql = "WHERE status = :status"
+        conditions.append("status = :status")
         params["status"] = status
+    if key:
+        kind, params["so"], params["cr"], params["cid"] = key
+        conditions.append(_CASES_KEY_CONDITIONS[kind])
 
+    backward = key is not None and key[0] == "p"
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     sql = text(f"""
         SELECT
             case_id,
@@ -296,16 +481,47 @@ async def get_cases_page(
             updated
         FROM {table_name}
         {where_sql}
-        ORDER BY sort_order ASC, created DESC, case_id DESC
-        LIMIT :limit OFFSET :offset;
+        {_CASES_ORDER_REV if backward else _CASES_ORDER_FWD}
+        LIMIT :limit;
     """)
 
-    async with db_manager as client:
-        async with client.session() as session:
-            result = await session.execute(sql, params)
-            rows = result.fetchall()
-            return [dict(row._mapping) for row in rows]
-        
+    async with db_session() as session:
+        result = await session.execute(sql, params)
+        rows = [dict(row._mapping) for row in result.fetchall()]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        # курсор устарел или упёрлись в начало списка — отдаём первую страницу
+        restart = key is not None and (not rows or (backward and not has_more))
+
+        if backward:
+            rows.reverse()
+            has_prev, has_next = has_more, True
+        elif not restart:
+            has_next = has_more
+            has_prev = key is not None and key[0] == "n"
+            if key and key[0] == "s":
+                probe_params = {"so": rows[0]["sort_order"], "cr": rows[0]["created"], "cid": rows[0]["case_id"]}
+                probe_where = _CASES_KEY_CONDITIONS["p"]
+                if status:
+                    probe_where += " AND status = :status"
+                    probe_params["status"] = status
+                probe = await session.execute(
+                    text(f"SELECT EXISTS (SELECT 1 FROM {table_name} WHERE {probe_where});"),
+                    probe_params
+                )
+                has_prev = bool(probe.scalar_one())
+
+    if restart:
+        return await get_cases_page(None, limit=limit, table_name=table_name, status=status)
+
+    return {
+        "items": rows,
+        "cursor": encode_case_cursor("s", rows[0]) if rows and has_prev else "",
+        "prev_cursor": encode_case_cursor("p", rows[0]) if rows and has_prev else None,
+        "next_cursor": encode_case_cursor("n", rows[-1]) if rows and has_next else None,
+    }
+
 
 async def create_case_draft(
     title: str = "Новый кейс",
@@ -318,16 +534,15 @@ async def create_case_draft(
         VALUES (:title, :description, 'draft', :sort_order)
         RETURNING case_id;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            res = await session.execute(sql, {
-                "title": title,
-                "description": description,
-                "sort_order": sort_order
-            })
-            case_id = int(res.scalar_one())
-            await session.commit()
-            return case_id
+    async with db_session() as session:
+        res = await session.execute(sql, {
+            "title": title,
+            "description": description,
+            "sort_order": sort_order
+        })
+        case_id = int(res.scalar_one())
+        await session.commit()
+        return case_id
         
 
 async def get_case_by_id(case_id: int, table_name: str = CASES_TABLE) -> Optional[Dict[str, Any]]:
@@ -336,11 +551,10 @@ async def get_case_by_id(case_id: int, table_name: str = CASES_TABLE) -> Optiona
         FROM {table_name}
         WHERE case_id = :case_id;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            res = await session.execute(sql, {"case_id": case_id})
-            row = res.fetchone()
-            return dict(row._mapping) if row else None
+    async with db_session() as session:
+        res = await session.execute(sql, {"case_id": case_id})
+        row = res.fetchone()
+        return dict(row._mapping) if row else None
         
 
 async def update_case_field(case_id: int, field: str, value: Any, table_name: str = CASES_TABLE) -> None:
@@ -353,10 +567,32 @@ async def update_case_field(case_id: int, field: str, value: Any, table_name: st
             updated = CURRENT_TIMESTAMP
         WHERE case_id = :case_id;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            await session.execute(sql, {"case_id": case_id, "value": value})
-            await session.commit()
+    async with db_session() as session:
+        await session.execute(sql, {"case_id": case_id, "value": value})
+        await session.commit()
+    case_bundle_cache.invalidate(case_id)
+
+
+async def bulk_insert(
+    session,
+    table_name: str,
+    columns: Dict[str, str],
+    rows: List[Dict[str, Any]]
+) -> None:
+    """
+    Вставляет rows одним запросом INSERT ... SELECT FROM unnest(...) в рамках переданной сессии
+    (транзакцией и commit управляет вызывающий код).
+    columns — имя колонки -> SQL-тип её значений, например {"case_id": "BIGINT", "tg_file_id": "VARCHAR"}.
+    """
+    if not rows:
+        return
+    names = list(columns)
+    arrays = ", ".join(f"CAST(:{name} AS {columns[name]}[])" for name in names)
+    sql = text(f"""
+        INSERT INTO {table_name} ({", ".join(names)})
+        SELECT * FROM unnest({arrays});
+    """)
+    await session.execute(sql, {name: [row.get(name) for row in rows] for name in names})
 
 
 async def set_case_cover(case_id: int, tg_file_id: str, table_name: str = IMAGES_TABLE) -> None:
@@ -376,11 +612,11 @@ async def set_case_cover(case_id: int, tg_file_id: str, table_name: str = IMAGES
         VALUES (:case_id, :tg_file_id, 0, TRUE);
     """)
 
-    async with db_manager as client:
-        async with client.session() as session:
-            await session.execute(sql_reset, {"case_id": case_id})
-            await session.execute(sql_insert, {"case_id": case_id, "tg_file_id": tg_file_id})
-            await session.commit()
+    async with db_session() as session:
+        await session.execute(sql_reset, {"case_id": case_id})
+        await session.execute(sql_insert, {"case_id": case_id, "tg_file_id": tg_file_id})
+        await session.commit()
+    case_bundle_cache.invalidate(case_id)
 
 
 async def add_case_images(
@@ -398,26 +634,22 @@ async def add_case_images(
         WHERE case_id = :case_id;
     """)
 
-    sql_insert = text(f"""
-        INSERT INTO {table_name} (case_id, tg_file_id, position, is_cover)
-        VALUES (:case_id, :tg_file_id, :position, :is_cover);
-    """)
-
-    async with db_manager as client:
-        async with client.session() as session:
-            # если хотим перезаписывать альбом — очищаем cover (не удаляем старые, только меняем признак)
-            await session.execute(sql_reset_cover, {"case_id": case_id})
-
-            for i, fid in enumerate(tg_file_ids):
-                is_cover = (i == 0) if make_first_cover else False
-                await session.execute(sql_insert, {
-                    "case_id": case_id,
-                    "tg_file_id": fid,
-                    "position": i,
-                    "is_cover": is_cover
-                })
+    rows = [
+        {
+            "case_id": case_id,
+            "tg_file_id": fid,
+            "position": i,
+            "is_cover": (i == 0) if make_first_cover else False
+        }
+        for i, fid in enumerate(tg_file_ids)
+    ]
 
-            await session.commit()
+    async with db_session() as session:
+        # если хотим перезаписывать альбом — очищаем cover (не удаляем старые, только меняем признак)
+        await session.execute(sql_reset_cover, {"case_id": case_id})
+        await bulk_insert(session, table_name, CASE_MEDIA_COLUMNS, rows)
+        await session.commit()
+    case_bundle_cache.invalidate(case_id)
 
 
 async def add_case_media(
@@ -435,30 +667,24 @@ async def add_case_media(
         WHERE case_id = :case_id;
     """)
 
-    sql_insert = text(f"""
-        INSERT INTO {table_name} (case_id, tg_file_id, position, is_cover, media_type)
-        VALUES (:case_id, :tg_file_id, :position, :is_cover, :media_type);
-    """)
-
-    async with db_manager as client:
-        async with client.session() as session:
-            await session.execute(sql_reset_cover, {"case_id": case_id})
-
-            for i, item in enumerate(items):
-                tg_file_id = item.get("tg_file_id")
-                media_type = item.get("media_type") or "photo"
-                if not tg_file_id:
-                    continue
-                is_cover = (i == 0) if make_first_cover else False
-                await session.execute(sql_insert, {
-                    "case_id": case_id,
-                    "tg_file_id": tg_file_id,
-                    "position": i,
-                    "is_cover": is_cover,
-                    "media_type": media_type
-                })
+    # позиция и признак обложки считаются по исходному индексу, как и раньше
+    rows = [
+        {
+            "case_id": case_id,
+            "tg_file_id": item.get("tg_file_id"),
+            "position": i,
+            "is_cover": (i == 0) if make_first_cover else False,
+            "media_type": item.get("media_type") or "photo"
+        }
+        for i, item in enumerate(items)
+        if item.get("tg_file_id")
+    ]
 
-            await session.commit()
+    async with db_session() as session:
+        await session.execute(sql_reset_cover, {"case_id": case_id})
+        await bulk_insert(session, table_name, {**CASE_MEDIA_COLUMNS, "media_type": "VARCHAR"}, rows)
+        await session.commit()
+    case_bundle_cache.invalidate(case_id)
 
 
 async def get_case_images(case_id: int, table_name: str = IMAGES_TABLE) -> List[Dict[str, Any]]:
@@ -468,11 +694,10 @@ async def get_case_images(case_id: int, table_name: str = IMAGES_TABLE) -> List[
         WHERE case_id = :case_id
         ORDER BY is_cover DESC, position ASC, created ASC, image_id ASC;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            res = await session.execute(sql, {"case_id": case_id})
-            rows = res.fetchall()
-            return [dict(r._mapping) for r in rows]
+    async with db_session() as session:
+        res = await session.execute(sql, {"case_id": case_id})
+        rows = res.fetchall()
+        return [dict(r._mapping) for r in rows]
         
 
 async def delete_case_images(case_id: int, table_name: str = IMAGES_TABLE) -> None:
@@ -480,10 +705,10 @@ async def delete_case_images(case_id: int, table_name: str = IMAGES_TABLE) -> No
         DELETE FROM {table_name}
         WHERE case_id = :case_id;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            await session.execute(sql, {"case_id": case_id})
-            await session.commit()
+    async with db_session() as session:
+        await session.execute(sql, {"case_id": case_id})
+        await session.commit()
+    case_bundle_cache.invalidate(case_id)
 
 
 async def get_case_review(case_id: int) -> Optional[Dict[str, Any]]:
@@ -498,16 +723,15 @@ async def get_case_review(case_id: int) -> Optional[Dict[str, Any]]:
         WHERE review_id = :review_id
         ORDER BY position ASC, item_id ASC;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            review_res = await session.execute(review_sql, {"case_id": case_id})
-            review_row = review_res.fetchone()
-            if not review_row:
-                return None
-            review = dict(review_row._mapping)
-            items_res = await session.execute(items_sql, {"review_id": review["review_id"]})
-            items = [dict(r._mapping) for r in items_res.fetchall()]
-            return {"review": review, "items": items}
+    async with db_session() as session:
+        review_res = await session.execute(review_sql, {"case_id": case_id})
+        review_row = review_res.fetchone()
+        if not review_row:
+            return None
+        review = dict(review_row._mapping)
+        items_res = await session.execute(items_sql, {"review_id": review["review_id"]})
+        items = [dict(r._mapping) for r in items_res.fetchall()]
+        return {"review": review, "items": items}
 
 
 async def upsert_case_review(case_id: int, items: List[Dict[str, Any]]) -> None:
@@ -522,24 +746,22 @@ async def upsert_case_review(case_id: int, items: List[Dict[str, Any]]) -> None:
         DELETE FROM case_review_items
         WHERE review_id = :review_id;
     """)
-    insert_item_sql = text("""
-        INSERT INTO case_review_items (review_id, tg_file_id, media_type, text_content, position)
-        VALUES (:review_id, :tg_file_id, :media_type, :text_content, :position);
-    """)
-    async with db_manager as client:
-        async with client.session() as session:
-            res = await session.execute(review_sql, {"case_id": case_id})
-            review_id = int(res.scalar_one())
-            await session.execute(delete_items_sql, {"review_id": review_id})
-            for i, item in enumerate(items):
-                await session.execute(insert_item_sql, {
-                    "review_id": review_id,
-                    "tg_file_id": item.get("tg_file_id"),
-                    "media_type": item.get("media_type"),
-                    "text_content": item.get("text_content"),
-                    "position": i
-                })
-            await session.commit()
+    async with db_session() as session:
+        res = await session.execute(review_sql, {"case_id": case_id})
+        review_id = int(res.scalar_one())
+        await session.execute(delete_items_sql, {"review_id": review_id})
+        await bulk_insert(session, "case_review_items", REVIEW_ITEM_COLUMNS, [
+            {
+                "review_id": review_id,
+                "tg_file_id": item.get("tg_file_id"),
+                "media_type": item.get("media_type"),
+                "text_content": item.get("text_content"),
+                "position": i
+            }
+            for i, item in enumerate(items)
+        ])
+        await session.commit()
+    case_bundle_cache.invalidate(case_id)
 
 
 async def delete_case_review(case_id: int) -> None:
@@ -547,10 +769,10 @@ async def delete_case_review(case_id: int) -> None:
         DELETE FROM case_reviews
         WHERE case_id = :case_id;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            await session.execute(sql, {"case_id": case_id})
-            await session.commit()
+    async with db_session() as session:
+        await session.execute(sql, {"case_id": case_id})
+        await session.commit()
+    case_bundle_cache.invalidate(case_id)
 
 
 async def get_case_cta(case_id: int) -> Optional[Dict[str, Any]]:
@@ -559,11 +781,131 @@ async def get_case_cta(case_id: int) -> Optional[Dict[str, Any]]:
         FROM case_cta
         WHERE case_id = :case_id;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            res = await session.execute(sql, {"case_id": case_id})
-            row = res.fetchone()
-            return dict(row._mapping) if row else None
+    async with db_session() as session:
+        res = await session.execute(sql, {"case_id": case_id})
+        row = res.fetchone()
+        return dict(row._mapping) if row else None
+
+
+# ------------------------------------------------------------------------ Кэш кейсов -----------------------------------------------------------------------------
+# Кейс целиком (строка, медиа по порядку, CTA, отзыв) для публичных экранов.
+# Админские функции записи выше/ниже сбрасывают запись кейса после commit.
+# Кэш локален для процесса: в других процессах бота изменения видны не позже CASE_CACHE_TTL.
+
+def _decode_json_row(value: Any) -> Any:
+    """JSON из json_agg/json_build_object -> dict/list, даты created/updated -> datetime."""
+    if isinstance(value, str):
+        value = json.loads(value)
+    if isinstance(value, list):
+        return [_decode_json_row(v) for v in value]
+    if isinstance(value, dict):
+        for key in ("created", "updated"):
+            if isinstance(value.get(key), str):
+                value[key] = datetime.fromisoformat(value[key])
+    return value
+
+
+async def get_case_bundle(case_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Кейс, его медиа (в порядке показа), CTA и отзыв с элементами — одним запросом.
+    Формат: {"case": {...}, "media": [...], "cta": {...} | None, "review": {"review": {...}, "items": [...]} | None}
+    """
+    sql = text(f"""
+        SELECT
+            c.case_id, c.title, c.description, c.status, c.sort_order, c.created, c.updated,
+            m.media,
+            t.cta,
+            r.review,
+            r.items
+        FROM {CASES_TABLE} c
+        LEFT JOIN LATERAL (
+            SELECT COALESCE(
+                json_agg(
+                    json_build_object(
+                        'image_id', i.image_id,
+                        'tg_file_id', i.tg_file_id,
+                        'media_type', i.media_type,
+                        'position', i.position,
+                        'is_cover', i.is_cover,
+                        'created', i.created
+                    )
+                    ORDER BY i.is_cover DESC, i.position ASC, i.created ASC, i.image_id ASC
+                ),
+                '[]'::json
+            ) AS media
+            FROM {IMAGES_TABLE} i
+            WHERE i.case_id = c.case_id
+        ) m ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT json_build_object(
+                'case_id', cta.case_id,
+                'button_text', cta.button_text,
+                'action_type', cta.action_type,
+                'action_value', cta.action_value,
+                'updated', cta.updated
+            ) AS cta
+            FROM case_cta cta
+            WHERE cta.case_id = c.case_id
+        ) t ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT
+                json_build_object(
+                    'review_id', rv.review_id,
+                    'case_id', rv.case_id,
+                    'created', rv.created,
+                    'updated', rv.updated
+                ) AS review,
+                (
+                    SELECT COALESCE(
+                        json_agg(
+                            json_build_object(
+                                'item_id', it.item_id,
+                                'tg_file_id', it.tg_file_id,
+                                'media_type', it.media_type,
+                                'text_content', it.text_content,
+                                'position', it.position,
+                                'created', it.created
+                            )
+                            ORDER BY it.position ASC, it.item_id ASC
+                        ),
+                        '[]'::json
+                    )
+                    FROM case_review_items it
+                    WHERE it.review_id = rv.review_id
+                ) AS items
+            FROM case_reviews rv
+            WHERE rv.case_id = c.case_id
+        ) r ON TRUE
+        WHERE c.case_id = :case_id;
+    """)
+    async with db_session() as session:
+        res = await session.execute(sql, {"case_id": case_id})
+        row = res.fetchone()
+    if not row:
+        return None
+
+    data = dict(row._mapping)
+    review = _decode_json_row(data.pop("review"))
+    items = _decode_json_row(data.pop("items"))
+    media = _decode_json_row(data.pop("media"))
+    cta = _decode_json_row(data.pop("cta"))
+    return {
+        "case": data,
+        "media": media or [],
+        "cta": cta,
+        "review": {"review": review, "items": items or []} if review else None,
+    }
+
+
+async def get_case_bundle_cached(case_id: int) -> Optional[Dict[str, Any]]:
+    bundle = case_bundle_cache.get(case_id)
+    if bundle is not None:
+        return bundle
+    generation = case_bundle_cache.generation(case_id)
+    bundle = await get_case_bundle(case_id)
+    if bundle is not None:
+        case_bundle_cache.set(case_id, bundle, generation)
+    return bundle
 
 
 async def upsert_case_cta(case_id: int, button_text: str, action_type: str, action_value: str | None) -> None:
@@ -577,15 +919,176 @@ async def upsert_case_cta(case_id: int, button_text: str, action_type: str, acti
             action_value = EXCLUDED.action_value,
             updated = CURRENT_TIMESTAMP;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
+    async with db_session() as session:
+        await session.execute(sql, {
+            "case_id": case_id,
+            "button_text": button_text,
+            "action_type": action_type,
+            "action_value": action_value
+        })
+        await session.commit()
+    case_bundle_cache.invalidate(case_id)
+
+
+def _event_rollup_ctes(source: str) -> str:
+    """
+    CTE, которые раскладывают строки source (created_at, user_id, event_type,
+    event_context, event_value, case_id) по дневным агрегатам. Подставляется и в пакетную
+    запись событий, и в пересчёт агрегатов.
+    """
+    case_types = ", ".join(f"'{t}'" for t in CASE_EVENT_TYPES)
+    return f"""
+        rollup_counts AS (
+            INSERT INTO {EVENTS_DAILY_TABLE} AS d (day, event_type, event_context, event_value, cnt)
+            SELECT created_at::date, event_type, COALESCE(event_context, ''), COALESCE(event_value, ''), COUNT(*)
+            FROM {source}
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (day, event_type, event_context, event_value)
+            DO UPDATE SET cnt = d.cnt + EXCLUDED.cnt
+        ),
+        rollup_users AS (
+            INSERT INTO {EVENTS_DAILY_USERS_TABLE} AS d (day, event_type, user_id, first_at)
+            SELECT created_at::date, event_type, user_id, MIN(created_at)
+            FROM {source}
+            GROUP BY 1, 2, 3
+            ON CONFLICT (day, event_type, user_id)
+            DO UPDATE SET first_at = LEAST(d.first_at, EXCLUDED.first_at)
+            WHERE d.first_at IS NULL OR EXCLUDED.first_at < d.first_at
+        ),
+        rollup_cases AS (
+            INSERT INTO {EVENTS_DAILY_CASES_TABLE} AS d (day, case_id, event_type, cnt)
+            SELECT created_at::date, case_id, event_type, COUNT(*)
+            FROM {source}
+            WHERE event_type IN ({case_types})
+              AND case_id IS NOT NULL
+            GROUP BY 1, 2, 3
+            ON CONFLICT (day, event_type, case_id)
+            DO UPDATE SET cnt = d.cnt + EXCLUDED.cnt
+        )
+    """
+
+
+# Одна запись users_reg.last_activity на пользователя за пачку: берём последнее событие пачки.
+# Событие от пользователя значит, что бот ему снова доступен — возвращаем is_active после блокировки
+def _last_activity_cte(source: str, users_table: str = USERS_TABLE) -> str:
+    return f"""
+        touch_users AS (
+            UPDATE {users_table} u
+            SET last_activity = t.last_at, is_active = TRUE
+            FROM (
+                SELECT user_id, MAX(created_at) AS last_at
+                FROM {source}
+                GROUP BY user_id
+            ) t
+            WHERE u.user_id = t.user_id
+              AND (u.last_activity IS NULL OR u.last_activity < t.last_at)
+        )
+    """
+
+
+async def insert_events_bulk(events: List[Dict[str, Any]]) -> None:
+    """
+    Пишет пачку событий одним INSERT ... SELECT FROM unnest(...) и в том же
+    запросе прибавляет их к дневным агрегатам и сдвигает last_activity пользователей.
+    created_at восстанавливается как NOW() минус время ожидания события в буфере,
+    чтобы не зависеть от часового пояса процесса бота.
+    """
+    if not events:
+        return
+
+    by_table: Dict[str, List[Dict[str, Any]]] = {}
+    for event in events:
+        by_table.setdefault(event.get("table_name") or EVENTS_TABLE, []).append(event)
+
+    now_ts = time.monotonic()
+    async with db_session() as session:
+        for table_name, rows in by_table.items():
+            # агрегаты и last_activity ведутся только для основной таблицы событий
+            rollup_sql = f",{_event_rollup_ctes('ins')},{_last_activity_cte('ins')}" if table_name == EVENTS_TABLE else ""
+            sql = text(f"""
+                WITH ins AS (
+                    INSERT INTO {table_name} (user_id, event_type, event_context, event_value, case_id, payload, created_at)
+                    SELECT
+                        e.user_id,
+                        e.event_type,
+                        e.event_context,
+                        e.event_value,
+                        e.case_id,
+                        e.payload::jsonb,
+                        NOW() - make_interval(secs => e.age)
+                    FROM unnest(
+                        CAST(:user_ids AS BIGINT[]),
+                        CAST(:event_types AS VARCHAR[]),
+                        CAST(:event_contexts AS VARCHAR[]),
+                        CAST(:event_values AS VARCHAR[]),
+                        CAST(:case_ids AS BIGINT[]),
+                        CAST(:payloads AS TEXT[]),
+                        CAST(:ages AS DOUBLE PRECISION[])
+                    ) AS e(user_id, event_type, event_context, event_value, case_id, payload, age)
+                    RETURNING created_at, user_id, event_type, event_context, event_value, case_id
+                ){rollup_sql}
+                SELECT COUNT(*) FROM ins;
+            """)
             await session.execute(sql, {
-                "case_id": case_id,
-                "button_text": button_text,
-                "action_type": action_type,
-                "action_value": action_value
+                "user_ids": [r["user_id"] for r in rows],
+                "event_types": [r["event_type"] for r in rows],
+                "event_contexts": [r.get("event_context") for r in rows],
+                "event_values": [r.get("event_value") for r in rows],
+                "case_ids": [r.get("case_id") for r in rows],
+                "payloads": [
+                    json.dumps(r["payload"], ensure_ascii=False, default=str) if r.get("payload") is not None else None
+                    for r in rows
+                ],
+                "ages": [max(now_ts - r.get("enqueued_at", now_ts), 0.0) for r in rows],
             })
-            await session.commit()
+        await session.commit()
+
+
+# Пересчитываем дневные агрегаты по сырым событиям (все дни или последние days дней)
+async def rebuild_event_rollups(days: Optional[int] = None) -> None:
+    async with db_session() as session:
+        await rebuild_event_rollups_in(session, days)
+        await session.commit()
+
+
+# То же внутри уже открытой транзакции (используется миграциями).
+# case_id_sql — выражение для case_id: до появления колонки миграция передаёт разбор event_value
+async def rebuild_event_rollups_in(session, days: Optional[int] = None, case_id_sql: str = "case_id") -> None:
+    params: Dict[str, Any] = {}
+    day_where = ""
+    event_where = ""
+    if days is not None:
+        day_where = "WHERE day >= CURRENT_DATE - CAST(:days AS INTEGER)"
+        event_where = "WHERE created_at >= CURRENT_DATE - CAST(:days AS INTEGER)"
+        params["days"] = int(days)
+
+    for table_name in (EVENTS_DAILY_TABLE, EVENTS_DAILY_USERS_TABLE, EVENTS_DAILY_CASES_TABLE):
+        await session.execute(text(f"DELETE FROM {table_name} {day_where};"), params)
+    await session.execute(text(f"""
+        WITH src AS (
+            SELECT created_at, user_id, event_type, event_context, event_value, {case_id_sql} AS case_id
+            FROM {EVENTS_TABLE}
+            {event_where}
+        ),{_event_rollup_ctes('src')}
+        SELECT 1;
+    """), params)
+
+
+# Общий буфер событий: обработчики только кладут событие в память, запись в БД — пачками в фоне
+event_buffer = EventBuffer(flush_func=insert_events_bulk, **events_buffer_settings)
+
+
+# case_id события: явный, из payload или (для событий кейса) из event_value
+def _event_case_id(event_type: str, event_value: str | None, payload: dict | None, case_id: int | None) -> int | None:
+    if case_id is None and isinstance(payload, dict):
+        case_id = payload.get("case_id")
+    if case_id is None and event_type in CASE_EVENT_TYPES:
+        case_id = event_value
+    try:
+        case_id = int(case_id) if case_id is not None else None
+    except (TypeError, ValueError):
+        return None
+    return case_id if case_id is not None and 0 < case_id < 2 ** 63 else None
 
 
 async def log_event(
@@ -594,183 +1097,329 @@ async def log_event(
     event_context: str | None = None,
     event_value: str | None = None,
     payload: dict | None = None,
-    table_name: str = EVENTS_TABLE
+    table_name: str = EVENTS_TABLE,
+    case_id: int | None = None
 ) -> None:
     try:
-        sql = text(f"""
-            INSERT INTO {table_name} (user_id, event_type, event_context, event_value, payload)
-            VALUES (:user_id, :event_type, :event_context, :event_value, :payload);
-        """)
-        async with db_manager as client:
-            async with client.session() as session:
-                params = {
-                    "user_id": user_id,
-                    "event_type": event_type,
-                    "event_context": event_context,
-                    "event_value": event_value,
-                    "payload": payload
-                }
-                try:
-                    await session.execute(sql, params)
-                except Exception:
-                    try:
-                        await session.rollback()
-                        await session.execute(sql, {
-                            **params,
-                            "payload": json.dumps(payload) if payload is not None else None
-                        })
-                    except Exception:
-                        return
-                await session.commit()
+        event_buffer.add({
+            "user_id": user_id,
+            "event_type": event_type,
+            "event_context": event_context,
+            "event_value": event_value,
+            "case_id": _event_case_id(event_type, event_value, payload, case_id),
+            "payload": payload,
+            "table_name": table_name,
+            "enqueued_at": time.monotonic()
+        })
     except Exception:
         pass
 
 
-async def get_events_total(days: int = 30, table_name: str = EVENTS_TABLE) -> int:
+# Отчётные выборки ниже читают дневные агрегаты, а не сырые события:
+# окно в days дней — это дни с CURRENT_DATE - days по сегодняшний включительно
+async def get_events_total(days: int = 30, table_name: str = EVENTS_DAILY_TABLE) -> int:
     sql = text(f"""
-        SELECT COUNT(*)
+        SELECT COALESCE(SUM(cnt), 0)::BIGINT
         FROM {table_name}
-        WHERE created_at >= NOW() - (INTERVAL '1 day' * :days);
+        WHERE day >= CURRENT_DATE - CAST(:days AS INTEGER);
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            res = await session.execute(sql, {"days": days})
-            return int(res.scalar_one())
+    async with db_session() as session:
+        res = await session.execute(sql, {"days": days})
+        return int(res.scalar_one())
 
 
 async def get_top_menu_clicks(
     days: int = 30,
     limit: int = 15,
-    table_name: str = EVENTS_TABLE
+    table_name: str = EVENTS_DAILY_TABLE
 ) -> List[Dict[str, Any]]:
     sql = text(f"""
         SELECT
-            event_context,
-            event_value,
-            COUNT(*) AS cnt
+            NULLIF(event_context, '') AS event_context,
+            NULLIF(event_value, '') AS event_value,
+            SUM(cnt)::BIGINT AS cnt
         FROM {table_name}
         WHERE event_type = 'menu_click'
-          AND created_at >= NOW() - (INTERVAL '1 day' * :days)
+          AND day >= CURRENT_DATE - CAST(:days AS INTEGER)
         GROUP BY event_context, event_value
         ORDER BY cnt DESC
         LIMIT :limit;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            res = await session.execute(sql, {"days": days, "limit": limit})
-            rows = res.fetchall()
-            return [dict(r._mapping) for r in rows]
+    async with db_session() as session:
+        res = await session.execute(sql, {"days": days, "limit": limit})
+        rows = res.fetchall()
+        return [dict(r._mapping) for r in rows]
 
 
 async def get_top_cases(
     days: int = 30,
     limit: int = 10,
-    table_name: str = EVENTS_TABLE,
+    table_name: str = EVENTS_DAILY_CASES_TABLE,
     cases_table: str = CASES_TABLE
 ) -> List[Dict[str, Any]]:
     sql = text(f"""
         SELECT
             c.case_id,
             c.title,
-            COUNT(*) AS cnt
-        FROM {table_name} e
+            SUM(d.cnt)::BIGINT AS cnt
+        FROM {table_name} d
         JOIN {cases_table} c
-          ON c.case_id = e.event_value::BIGINT
-        WHERE e.event_type = 'case_view'
-          AND e.event_value ~ '^[0-9]+$'
-          AND e.created_at >= NOW() - (INTERVAL '1 day' * :days)
+          ON c.case_id = d.case_id
+        WHERE d.event_type = 'case_view'
+          AND d.day >= CURRENT_DATE - CAST(:days AS INTEGER)
         GROUP BY c.case_id, c.title
         ORDER BY cnt DESC
         LIMIT :limit;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            res = await session.execute(sql, {"days": days, "limit": limit})
-            rows = res.fetchall()
-            return [dict(r._mapping) for r in rows]
+    async with db_session() as session:
+        res = await session.execute(sql, {"days": days, "limit": limit})
+        rows = res.fetchall()
+        return [dict(r._mapping) for r in rows]
+
 
+FUNNEL_STEPS = ('start', 'cases_open', 'case_view', 'contact_open')
+STUCK_POINTS = (
+    ("start", "cases_open", "Стартовали, но не открыли список кейсов"),
+    ("cases_open", "case_view", "Открыли список, но не открыли кейс"),
+    ("case_view", "contact_open", "Смотрели кейс, но не открыли контакты"),
+)
 
-async def get_funnel(
+
+async def get_funnel_report(
     days: int = 30,
-    table_name: str = EVENTS_TABLE
-) -> List[Dict[str, Any]]:
+    steps: Sequence[str] = FUNNEL_STEPS,
+    stuck_points: Sequence[Tuple[str, str, str]] = STUCK_POINTS,
+    table_name: str = EVENTS_DAILY_USERS_TABLE
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Воронка и точки застревания за один проход по дневному агрегату пользователей
+    (user_events_daily_users) — без чтения сырых событий, окно то же, что у остальных
+    запросов отчёта: day >= CURRENT_DATE - days.
+    Для каждого пользователя берётся время первого появления каждого шага (first_at),
+    дальше все показатели считаются по этой таблице:
+    - users: дошли до шага (в любом порядке);
+    - ordered_users: прошли шаги по порядку (первое появление шага не раньше предыдущего);
+    - stuck: сделали from_event, но ни разу не сделали to_event.
+    """
+    event_types = list(dict.fromkeys([*steps, *(p for point in stuck_points for p in point[:2])]))
+    col = {event_type: f"t{i}" for i, event_type in enumerate(event_types)}
+    params: Dict[str, Any] = {"days": days}
+    first_seen_cols = []
+    for i, event_type in enumerate(event_types):
+        params[f"e{i}"] = event_type
+        # first_at пуст только у строк, чьи сырые события удалены до шага миграции 11, — берём начало дня
+        first_seen_cols.append(
+            f"MIN(COALESCE(first_at, day)) FILTER (WHERE event_type = :e{i}) AS {col[event_type]}"
+        )
+
+    select_cols = []
+    for i, step in enumerate(steps):
+        select_cols.append(f"COUNT({col[step]}) AS reached_{i}")
+        chain = [f"{col[steps[0]]} IS NOT NULL"]
+        chain += [f"{col[steps[j]]} >= {col[steps[j - 1]]}" for j in range(1, i + 1)]
+        select_cols.append(f"COUNT(*) FILTER (WHERE {' AND '.join(chain)}) AS ordered_{i}")
+    for i, (from_event, to_event, _) in enumerate(stuck_points):
+        select_cols.append(
+            f"COUNT(*) FILTER (WHERE {col[from_event]} IS NOT NULL AND {col[to_event]} IS NULL) AS stuck_{i}"
+        )
+
+    in_list = ", ".join(f":e{i}" for i in range(len(event_types)))
     sql = text(f"""
-        SELECT
-            event_type,
-            COUNT(DISTINCT user_id) AS users
-        FROM {table_name}
-        WHERE event_type IN ('start', 'cases_open', 'case_view', 'contact_open')
-          AND created_at >= NOW() - (INTERVAL '1 day' * :days)
-        GROUP BY event_type;
+        WITH per_user AS (
+            SELECT user_id, {", ".join(first_seen_cols)}
+            FROM {table_name}
+            WHERE event_type IN ({in_list})
+              AND day >= CURRENT_DATE - CAST(:days AS INTEGER)
+            GROUP BY user_id
+        )
+        SELECT {", ".join(select_cols)}
+        FROM per_user;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            res = await session.execute(sql, {"days": days})
-            rows = res.fetchall()
-            return [dict(r._mapping) for r in rows]
+    async with db_session() as session:
+        res = await session.execute(sql, params)
+        row = res.fetchone()._mapping
+
+    return {
+        "steps": [
+            {"event_type": step, "users": int(row[f"reached_{i}"]), "ordered_users": int(row[f"ordered_{i}"])}
+            for i, step in enumerate(steps)
+        ],
+        "stuck": [
+            {"label": label, "users": int(row[f"stuck_{i}"])}
+            for i, (_, _, label) in enumerate(stuck_points)
+        ],
+    }
 
 
 async def get_stuck_points(
     days: int = 30,
     limit: int = 10,
-    table_name: str = EVENTS_TABLE
+    table_name: str = EVENTS_DAILY_USERS_TABLE
 ) -> List[Dict[str, Any]]:
-    sql_base = text(f"""
-        WITH recent AS (
-            SELECT user_id, event_type
-            FROM {table_name}
-            WHERE created_at >= NOW() - (INTERVAL '1 day' * :days)
-        )
-        SELECT COUNT(DISTINCT r.user_id) AS users
-        FROM recent r
-        WHERE r.event_type = :from_event
-          AND NOT EXISTS (
-              SELECT 1 FROM recent r2
-              WHERE r2.user_id = r.user_id
-                AND r2.event_type = :to_event
-          );
-    """)
-
-    points = [
-        ("start", "cases_open", "Стартовали, но не открыли список кейсов"),
-        ("cases_open", "case_view", "Открыли список, но не открыли кейс"),
-        ("case_view", "contact_open", "Смотрели кейс, но не открыли контакты"),
-    ]
-
-    results: List[Dict[str, Any]] = []
-    async with db_manager as client:
-        async with client.session() as session:
-            for from_event, to_event, label in points:
-                res = await session.execute(sql_base, {
-                    "days": days,
-                    "from_event": from_event,
-                    "to_event": to_event
-                })
-                users = int(res.scalar_one())
-                results.append({"label": label, "users": users})
-
-    return results[:limit]
+    report = await get_funnel_report(days=days, table_name=table_name)
+    return report["stuck"][:limit]
 
 
+# Последние активные пользователи: last_activity ведёт insert_events_bulk, чтение идёт по индексу idx_users_reg_last_activity
 async def get_recent_users(
     limit: int = 100,
-    table_users: str = USERS_TABLE,
-    table_events: str = EVENTS_TABLE
+    table_users: str = USERS_TABLE
 ) -> List[Dict[str, Any]]:
     sql = text(f"""
         SELECT
-            u.user_id,
-            u.user_login AS username,
-            u.full_name,
-            MAX(e.created_at) AS last_activity
-        FROM {table_events} e
-        JOIN {table_users} u ON u.user_id = e.user_id
-        GROUP BY u.user_id, u.user_login, u.full_name
-        ORDER BY last_activity DESC
+            user_id,
+            user_login AS username,
+            full_name,
+            last_activity
+        FROM {table_users}
+        WHERE last_activity IS NOT NULL
+        ORDER BY last_activity DESC NULLS LAST
+        LIMIT :limit;
+    """)
+    async with db_session() as session:
+        res = await session.execute(sql, {"limit": limit})
+        rows = res.fetchall()
+        return [dict(r._mapping) for r in rows]
+
+
+# ------------------------------------------------------------------------ Рассылки --------------------------------------------------------------------------------
+
+async def get_active_user_count(table_name: str = USERS_TABLE) -> int:
+    sql = text(f"SELECT COUNT(*) FROM {table_name} WHERE is_active;")
+    async with db_session() as session:
+        res = await session.execute(sql)
+        return int(res.scalar_one())
+
+
+async def create_broadcast(created_by: int, chat_id: int, content: Dict[str, Any]) -> int:
+    sql = text(f"""
+        INSERT INTO {BROADCASTS_TABLE} (created_by, chat_id, content, total)
+        SELECT :created_by, :chat_id, CAST(:content AS JSONB), COUNT(*)
+        FROM {USERS_TABLE}
+        WHERE is_active
+        RETURNING broadcast_id;
+    """)
+    async with db_session() as session:
+        res = await session.execute(sql, {
+            "created_by": created_by,
+            "chat_id": chat_id,
+            "content": json.dumps(content, ensure_ascii=False),
+        })
+        broadcast_id = int(res.scalar_one())
+        await session.commit()
+        return broadcast_id
+
+
+def _broadcast_row(row) -> Dict[str, Any]:
+    item = dict(row._mapping)
+    item["content"] = _decode_json_row(item.get("content")) or {}
+    return item
+
+
+_BROADCAST_COLUMNS = "broadcast_id, created_by, chat_id, content, status, total, sent, failed, blocked, created_at, finished_at"
+
+
+async def get_broadcast(broadcast_id: int) -> Optional[Dict[str, Any]]:
+    sql = text(f"SELECT {_BROADCAST_COLUMNS} FROM {BROADCASTS_TABLE} WHERE broadcast_id = :broadcast_id;")
+    async with db_session() as session:
+        res = await session.execute(sql, {"broadcast_id": broadcast_id})
+        row = res.fetchone()
+        return _broadcast_row(row) if row else None
+
+
+async def get_last_broadcast() -> Optional[Dict[str, Any]]:
+    sql = text(f"SELECT {_BROADCAST_COLUMNS} FROM {BROADCASTS_TABLE} ORDER BY broadcast_id DESC LIMIT 1;")
+    async with db_session() as session:
+        res = await session.execute(sql)
+        row = res.fetchone()
+        return _broadcast_row(row) if row else None
+
+
+async def get_running_broadcasts() -> List[Dict[str, Any]]:
+    sql = text(f"SELECT {_BROADCAST_COLUMNS} FROM {BROADCASTS_TABLE} WHERE status = 'running' ORDER BY broadcast_id;")
+    async with db_session() as session:
+        res = await session.execute(sql)
+        return [_broadcast_row(row) for row in res.fetchall()]
+
+
+async def set_broadcast_status(broadcast_id: int, status: str) -> None:
+    sql = text(f"""
+        UPDATE {BROADCASTS_TABLE}
+        SET status = :status,
+            finished_at = CASE WHEN CAST(:status AS VARCHAR) = 'running' THEN NULL ELSE CURRENT_TIMESTAMP END
+        WHERE broadcast_id = :broadcast_id;
+    """)
+    async with db_session() as session:
+        await session.execute(sql, {"broadcast_id": broadcast_id, "status": status})
+        await session.commit()
+
+
+# Следующая пачка получателей рассылки: активные пользователи после after_user_id, которым ещё не отправляли.
+# Keyset по user_id короткими запросами, а не iter_users: курсор iter_users держал бы транзакцию всю рассылку
+async def get_broadcast_recipients(broadcast_id: int, after_user_id: int = 0, limit: int = 500) -> List[int]:
+    sql = text(f"""
+        SELECT u.user_id
+        FROM {USERS_TABLE} u
+        WHERE u.is_active
+          AND u.user_id > :after_user_id
+          AND NOT EXISTS (
+              SELECT 1 FROM {BROADCAST_RECIPIENTS_TABLE} r
+              WHERE r.broadcast_id = :broadcast_id AND r.user_id = u.user_id
+          )
+        ORDER BY u.user_id
         LIMIT :limit;
     """)
-    async with db_manager as client:
-        async with client.session() as session:
-            res = await session.execute(sql, {"limit": limit})
-            rows = res.fetchall()
-            return [dict(r._mapping) for r in rows]
+    async with db_session() as session:
+        res = await session.execute(sql, {"broadcast_id": broadcast_id, "after_user_id": after_user_id, "limit": limit})
+        return [int(row[0]) for row in res.fetchall()]
+
+
+async def save_broadcast_results(broadcast_id: int, results: List[Tuple[int, str, Optional[str]]]) -> None:
+    """
+    Пишет статусы доставки пачки (user_id, status, error) одним запросом, в той же транзакции
+    прибавляет их к счётчикам рассылки и помечает заблокировавших бота неактивными.
+    status: sent | failed | blocked.
+    """
+    if not results:
+        return
+    sql = text(f"""
+        WITH t AS (
+            SELECT *
+            FROM unnest(
+                CAST(:user_ids AS BIGINT[]),
+                CAST(:statuses AS VARCHAR[]),
+                CAST(:errors AS VARCHAR[])
+            ) AS t(user_id, status, error)
+        ),
+        ins AS (
+            INSERT INTO {BROADCAST_RECIPIENTS_TABLE} (broadcast_id, user_id, status, error)
+            SELECT :broadcast_id, user_id, status, LEFT(error, 255)
+            FROM t
+            ON CONFLICT (broadcast_id, user_id) DO NOTHING
+            RETURNING user_id, status
+        ),
+        counters AS (
+            UPDATE {BROADCASTS_TABLE} b
+            SET sent = b.sent + c.sent, failed = b.failed + c.failed, blocked = b.blocked + c.blocked
+            FROM (
+                SELECT
+                    COUNT(*) FILTER (WHERE status = 'sent') AS sent,
+                    COUNT(*) FILTER (WHERE status = 'failed') AS failed,
+                    COUNT(*) FILTER (WHERE status = 'blocked') AS blocked
+                FROM ins
+            ) c
+            WHERE b.broadcast_id = :broadcast_id
+        )
+        UPDATE {USERS_TABLE} u
+        SET is_active = FALSE
+        FROM ins
+        WHERE ins.status = 'blocked' AND u.user_id = ins.user_id;
+    """)
+    async with db_session() as session:
+        await session.execute(sql, {
+            "broadcast_id": broadcast_id,
+            "user_ids": [r[0] for r in results],
+            "statuses": [r[1] for r in results],
+            "errors": [r[2] for r in results],
+        })
+        await session.commit()
@@ -0,0 +1,71 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from create_bot import pg_link, db_pool_settings, logger
+
+_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[async_sessionmaker[AsyncSession]] = None
+
+
+# Приводим строку подключения к асинхронному драйверу asyncpg
+def _async_db_url(db_url: str) -> str:
+    for prefix in ("postgresql://", "postgres://"):
+        if db_url.startswith(prefix):
+            return "postgresql+asyncpg://" + db_url[len(prefix):]
+    return db_url
+
+
+# Строка подключения для прямого asyncpg.connect (без префикса драйвера SQLAlchemy)
+def asyncpg_dsn(db_url: str = pg_link) -> str:
+    for prefix in ("postgresql+asyncpg://", "postgres+asyncpg://"):
+        if db_url.startswith(prefix):
+            return "postgresql://" + db_url[len(prefix):]
+    return db_url
+
+
+# Открываем общий пул соединений (вызывается один раз при старте бота)
+async def open_pool() -> AsyncEngine:
+    global _engine, _session_factory
+    if _engine is not None:
+        return _engine
+
+    _engine = create_async_engine(
+        _async_db_url(pg_link),
+        pool_pre_ping=True,
+        **db_pool_settings
+    )
+    _session_factory = async_sessionmaker(_engine, class_=AsyncSession, expire_on_commit=False)
+    logger.info(
+        "DB pool opened: size=%s, overflow=%s, recycle=%ss",
+        db_pool_settings["pool_size"],
+        db_pool_settings["max_overflow"],
+        db_pool_settings["pool_recycle"],
+    )
+    return _engine
+
+
+# Закрываем пул и освобождаем соединения (вызывается при остановке бота)
+async def close_pool() -> None:
+    global _engine, _session_factory
+    if _engine is None:
+        return
+    engine = _engine
+    _engine = None
+    _session_factory = None
+    await engine.dispose()
+    logger.info("DB pool closed")
+
+
+def get_engine() -> Optional[AsyncEngine]:
+    return _engine
+
+
+# Сессия на соединении из общего пула; если пул ещё не открыт (например, CLI-скрипты) — открываем его лениво
+@asynccontextmanager
+async def db_session() -> AsyncIterator[AsyncSession]:
+    if _session_factory is None:
+        await open_pool()
+    async with _session_factory() as session:
+        yield session
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+FlushFunc = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+# База отклонила сами данные (тип, ограничение) — повтор той же пачки не поможет, в отличие от обрыва соединения
+def _is_data_error(e: Exception) -> bool:
+    return (
+        isinstance(e, DBAPIError)
+        and not isinstance(e, (OperationalError, InterfaceError))
+        and not e.connection_invalidated
+    )
+
+
+class EventBuffer:
+    """
+    Буфер аналитических событий в памяти процесса.
+    add() не ждёт базу: событие кладётся в очередь, а фоновая задача
+    пишет накопленное пачками — по размеру пачки или по таймеру.
+    Если база отклоняет данные пачки, пачка делится пополам, пока не останется
+    плохая строка — отбрасывается только она. При сбое соединения пачка
+    возвращается в очередь (не больше max_attempts попыток).
+    При остановке буфер дописывает всё, что осталось.
+    """
+
+    def __init__(
+        self,
+        flush_func: FlushFunc,
+        batch_size: int = 500,
+        flush_interval: float = 2.0,
+        max_size: int = 20000,
+        max_attempts: int = 3,
+    ):
+        self._flush_func = flush_func
+        self.batch_size = max(int(batch_size), 1)
+        self.flush_interval = max(float(flush_interval), 0.1)
+        self.max_attempts = max(int(max_attempts), 1)
+        # при переполнении теряем самые старые события, а не блокируем обработчики
+        self._items: Deque[Dict[str, Any]] = deque(maxlen=max(int(max_size), self.batch_size))
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, item: Dict[str, Any]) -> None:
+        if len(self._items) == self._items.maxlen:
+            self.dropped += 1
+        self._items.append(item)
+        if len(self._items) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name="event-buffer-flusher")
+
+    async def stop(self) -> None:
+        # не отменяем задачу посреди записи пачки: просим цикл выйти и ждём текущую запись
+        task, self._task = self._task, None
+        if task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await task
+        # дописываем остаток перед закрытием пула
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("EVENT BUFFER FLUSH ERROR")
+
+    async def flush(self) -> int:
+        written = 0
+        async with self._flush_lock:
+            while self._items:
+                batch = [self._items.popleft() for _ in range(min(self.batch_size, len(self._items)))]
+                # стек частей пачки: при ошибке данных часть делится пополам
+                parts = [batch]
+                part: List[Dict[str, Any]] = []
+                try:
+                    while parts:
+                        part = parts.pop()
+                        try:
+                            await self._flush_func(part)
+                            written += len(part)
+                        except Exception as e:
+                            if not _is_data_error(e):
+                                raise
+                            if len(part) > 1:
+                                middle = len(part) // 2
+                                parts += [part[middle:], part[:middle]]
+                            else:
+                                self.dropped += 1
+                                logger.error("EVENT BUFFER: event rejected by database, dropped: %s", e)
+                except asyncio.CancelledError:
+                    # запись прервали снаружи — незаписанное возвращаем без траты попытки
+                    self._requeue(part + [item for rest in reversed(parts) for item in rest], count_attempt=False)
+                    raise
+                except Exception:
+                    unwritten = part + [item for rest in reversed(parts) for item in rest]
+                    logger.exception("EVENT BUFFER FLUSH ERROR (%s events)", len(unwritten))
+                    self._requeue(unwritten)
+                    break
+        return written
+
+    def _requeue(self, batch: List[Dict[str, Any]], count_attempt: bool = True) -> None:
+        # возвращаем пачку в начало очереди, пока не исчерпаны попытки
+        for item in reversed(batch):
+            attempts = item.get("_attempts", 0) + (1 if count_attempt else 0)
+            if attempts >= self.max_attempts:
+                self.dropped += 1
+                continue
+            item["_attempts"] = attempts
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+                continue
+            self._items.appendleft(item)
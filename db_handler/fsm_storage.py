@@ -0,0 +1,246 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import text
+
+# модулем, а не именем: create_bot создаёт хранилище, пока db_pool может быть ещё не догружен
+from db_handler import db_pool
+
+logger = logging.getLogger(__name__)
+
+FSM_TABLE = 'fsm_storage'
+
+
+class _Record:
+    __slots__ = ("state", "data", "version", "loaded_at")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None, version: int = 0):
+        self.state = state
+        self.data = data or {}
+        # версия строки в базе, с которой сделана эта копия (0 — строки нет)
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+
+class PgStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в Postgres (таблица fsm_storage) с кэшем в памяти.
+    Чтение: первый доступ к ключу — один SELECT, дальше из памяти, пока копии не больше
+    cache_ttl секунд (несохранённые изменения читаются из памяти всегда).
+    Запись: set_state/set_data только помечают ключ изменённым, фоновая задача
+    раз в flush_interval пишет все изменённые ключи одним запросом — несколько
+    update_data за одно обновление превращаются в одну запись.
+    Запись условная по version: если строку с тех пор изменил другой процесс, она не
+    перезаписывается — наша копия выбрасывается, следующее чтение возьмёт строку из базы.
+    Несколько процессов бота: cache_ttl=0, тогда каждое обновление читает актуальную строку.
+    Данные должны быть JSON-совместимыми: set_data сразу проверяет это и хранит копию
+    в том виде, в каком она вернётся из базы.
+    При остановке (close) несохранённое дописывается.
+    """
+
+    def __init__(self, flush_interval: float = 1.0, cache_size: int = 10000, cache_ttl: float = 5.0):
+        self.flush_interval = max(float(flush_interval), 0.1)
+        self.cache_size = max(int(cache_size), 1)
+        self.cache_ttl = max(float(cache_ttl), 0.0)
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty: Set[str] = set()
+        # ключи, которые сейчас пишет flush(): их копию нельзя подменять строкой из базы
+        self._flushing: Set[str] = set()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) if part is not None else "" for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny,
+        ))
+
+    async def _record(self, key: StorageKey) -> _Record:
+        storage_key = self._key(key)
+        record = self._cache.get(storage_key)
+        if record is not None and (self._pinned(storage_key) or time.monotonic() - record.loaded_at < self.cache_ttl):
+            self._cache.move_to_end(storage_key)
+            return record
+
+        # один SELECT на ключ, даже если его запросили несколько обработчиков одновременно
+        pending = self._loading.get(storage_key)
+        if pending is not None:
+            return await pending
+        future = asyncio.get_running_loop().create_future()
+        self._loading[storage_key] = future
+        try:
+            record = await self._load(storage_key)
+            # пока шла загрузка, ключ могли записать — несохранённая запись свежее
+            if self._pinned(storage_key) and storage_key in self._cache:
+                record = self._cache[storage_key]
+            else:
+                self._cache[storage_key] = record
+            self._cache.move_to_end(storage_key)
+            self._trim()
+            future.set_result(record)
+            return record
+        except Exception as e:
+            future.set_exception(e)
+            # исключение уже получил вызывающий; ожидающих future может не быть
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(storage_key, None)
+
+    async def _load(self, storage_key: str) -> _Record:
+        async with db_pool.db_session() as session:
+            res = await session.execute(
+                text(f"SELECT state, data, version FROM {FSM_TABLE} WHERE key = :key;"),
+                {"key": storage_key}
+            )
+            row = res.fetchone()
+        if row is None:
+            return _Record()
+        data = row.data
+        if isinstance(data, str):
+            data = json.loads(data)
+        return _Record(row.state, data or {}, int(row.version))
+
+    def _pinned(self, storage_key: str) -> bool:
+        return storage_key in self._dirty or storage_key in self._flushing
+
+    def _touch(self, key: StorageKey) -> None:
+        self._dirty.add(self._key(key))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="fsm-storage-flusher")
+
+    def _trim(self) -> None:
+        # вытесняем только сохранённые записи
+        while len(self._cache) > self.cache_size:
+            for storage_key in self._cache:
+                if storage_key not in self._dirty:
+                    del self._cache[storage_key]
+                    break
+            else:
+                return
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        # TypeError сразу у вызывающего, а не в фоновой записи; в памяти — то же, что вернёт база
+        data_copy = json.loads(json.dumps(dict(data), ensure_ascii=False))
+        record = await self._record(key)
+        record.data = data_copy
+        self._touch(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy((await self._record(key)).data)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("FSM STORAGE FLUSH ERROR")
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            keys, self._dirty = self._dirty, set()
+            self._flushing = set(keys)
+            upserts: List[Tuple[str, _Record, str]] = []
+            deletes: List[Tuple[str, _Record]] = []
+            for storage_key in keys:
+                record = self._cache.get(storage_key)
+                if record is None:
+                    continue
+                if record.state is None and not record.data:
+                    deletes.append((storage_key, record))
+                else:
+                    upserts.append((storage_key, record, json.dumps(record.data, ensure_ascii=False)))
+            try:
+                async with db_pool.db_session() as session:
+                    written: Dict[str, int] = {}
+                    if upserts:
+                        # строка пишется, только если в базе та же версия, с которой мы её читали
+                        res = await session.execute(text(f"""
+                            INSERT INTO {FSM_TABLE} AS f (key, state, data, version, updated_at)
+                            SELECT t.key, t.state, t.data::jsonb, t.version + 1, CURRENT_TIMESTAMP
+                            FROM unnest(
+                                CAST(:keys AS TEXT[]),
+                                CAST(:states AS TEXT[]),
+                                CAST(:datas AS TEXT[]),
+                                CAST(:versions AS BIGINT[])
+                            ) AS t(key, state, data, version)
+                            ON CONFLICT (key)
+                            DO UPDATE SET
+                                state = EXCLUDED.state,
+                                data = EXCLUDED.data,
+                                version = EXCLUDED.version,
+                                updated_at = CURRENT_TIMESTAMP
+                            WHERE f.version = EXCLUDED.version - 1
+                            RETURNING f.key, f.version;
+                        """), {
+                            "keys": [u[0] for u in upserts],
+                            "states": [u[1].state for u in upserts],
+                            "datas": [u[2] for u in upserts],
+                            "versions": [u[1].version for u in upserts],
+                        })
+                        written = {row.key: int(row.version) for row in res.fetchall()}
+                    if deletes:
+                        res = await session.execute(text(f"""
+                            DELETE FROM {FSM_TABLE} f
+                            USING unnest(CAST(:keys AS TEXT[]), CAST(:versions AS BIGINT[])) AS t(key, version)
+                            WHERE f.key = t.key AND f.version = t.version
+                            RETURNING f.key;
+                        """), {
+                            "keys": [d[0] for d in deletes],
+                            "versions": [d[1].version for d in deletes],
+                        })
+                        deleted = {row.key for row in res.fetchall()}
+                        # строки не было и у нас (version 0) — удалять нечего, это не конфликт
+                        written.update({d[0]: 0 for d in deletes if d[0] in deleted or d[1].version == 0})
+                    await session.commit()
+            except Exception:
+                # вернём ключи в очередь — запишем при следующем проходе
+                self._dirty |= keys
+                raise
+            finally:
+                self._flushing = set()
+
+            for storage_key, record in [(u[0], u[1]) for u in upserts] + deletes:
+                if storage_key in written:
+                    record.version = written[storage_key]
+                    record.loaded_at = time.monotonic()
+                    continue
+                # строку изменил другой процесс — его запись новее нашей копии
+                logger.warning("FSM write conflict on %s: newer row in database, local change dropped", storage_key)
+                self._dirty.discard(storage_key)
+                if self._cache.get(storage_key) is record:
+                    del self._cache[storage_key]
+            self._trim()
+            return len(keys)
+
+    async def close(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("FSM STORAGE FINAL FLUSH ERROR")
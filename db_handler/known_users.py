@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LoadFunc = Callable[[int], Awaitable[Iterable[Tuple[int, Optional[str], Optional[str]]]]]
+
+
+class KnownUsers:
+    """
+    Индекс пользователей, уже записанных в users_reg: user_id -> хэш профиля (full_name, user_login).
+    Если профиль не изменился, повторная запись не нужна.
+    Заполняется лениво в фоне (не больше max_size самых активных пользователей)
+    и дальше по мере записи; при переполнении вытесняются давно не заходившие.
+    """
+
+    def __init__(self, load_func: LoadFunc, max_size: int = 100000):
+        self._load_func = load_func
+        self.max_size = max(int(max_size), 1)
+        self._hashes: "OrderedDict[int, int]" = OrderedDict()
+        self._load_task: Optional[asyncio.Task] = None
+        self.skipped = 0
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    @staticmethod
+    def profile_hash(user_data: Dict[str, Any]) -> int:
+        return hash((user_data.get("full_name") or "", user_data.get("user_login") or ""))
+
+    def ensure_loaded(self) -> None:
+        if self._load_task is None:
+            self._load_task = asyncio.create_task(self._load(), name="known-users-load")
+
+    async def _load(self) -> None:
+        try:
+            rows = await self._load_func(self.max_size)
+        except Exception:
+            logger.exception("KNOWN USERS LOAD ERROR")
+            return
+        for user_id, full_name, user_login in rows:
+            # записи, добавленные пока шла загрузка, свежее — их не трогаем
+            if user_id in self._hashes:
+                continue
+            self._hashes[user_id] = self.profile_hash({"full_name": full_name, "user_login": user_login})
+            self._hashes.move_to_end(user_id, last=False)
+        self._trim()
+
+    def is_current(self, user_id: int, profile_hash: int) -> bool:
+        if self._hashes.get(user_id) != profile_hash:
+            return False
+        self._hashes.move_to_end(user_id)
+        self.skipped += 1
+        return True
+
+    def remember(self, user_id: int, profile_hash: int) -> None:
+        self._hashes[user_id] = profile_hash
+        self._hashes.move_to_end(user_id)
+        self._trim()
+
+    def forget(self, user_id: int) -> None:
+        self._hashes.pop(user_id, None)
+
+    def _trim(self) -> None:
+        while len(self._hashes) > self.max_size:
+            self._hashes.popitem(last=False)
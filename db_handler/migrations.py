@@ -0,0 +1,593 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+from datetime import datetime
+from create_bot import events_partition_settings, logger
+from db_handler.db_pool import db_session, open_pool
+from db_handler.fsm_storage import FSM_TABLE
+from db_handler.db_funk import (
+    USERS_TABLE, CASES_TABLE, IMAGES_TABLE, EVENTS_TABLE, EVENTS_DEFAULT_PARTITION,
+    EVENTS_DAILY_TABLE, EVENTS_DAILY_USERS_TABLE, EVENTS_DAILY_CASES_TABLE, CASE_EVENT_TYPES,
+    BROADCASTS_TABLE, BROADCAST_RECIPIENTS_TABLE,
+    create_event_partitions, rebuild_event_rollups_in
+)
+from sqlalchemy import text
+
+# Версионированные миграции схемы.
+# Каждый шаг — идемпотентная функция над открытой транзакцией; номер применённого шага
+# пишется в schema_version в той же транзакции. Новые изменения схемы — только новым шагом в конце MIGRATIONS.
+
+SCHEMA_VERSION_TABLE = 'schema_version'
+# ключ pg_advisory_lock: два процесса не применяют миграции одновременно
+_MIGRATIONS_LOCK_KEY = 7_215_001
+
+Migration = Tuple[int, str, Callable[[Any], Awaitable[None]]]
+
+# размер пачки для шагов, которые переписывают существующие строки
+EVENTS_BACKFILL_BATCH = 10000
+# последний обработанный event_id заполнения user_events.case_id (шаг 3)
+_CASE_ID_BACKFILL_KEY = 'migration_0003_last_event_id'
+# case_id из event_value — так агрегаты считались до колонки user_events.case_id
+_LEGACY_CASE_ID_SQL = (
+    f"CASE WHEN event_type IN ({', '.join(repr(t) for t in CASE_EVENT_TYPES)}) "
+    "AND event_value ~ '^[0-9]{1,18}$' THEN event_value::BIGINT END"
+)
+
+
+# 1. Базовая схема: всё, что раньше создавал init_db() на каждом старте
+async def _m0001_base_schema(session) -> None:
+    users_sql = f"""
+    CREATE TABLE IF NOT EXISTS {USERS_TABLE} (
+        user_id   BIGINT PRIMARY KEY,
+        full_name VARCHAR(255),
+        user_login VARCHAR(255),
+        date_reg  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+
+    cases_sql = f"""
+    CREATE TABLE IF NOT EXISTS {CASES_TABLE} (
+        case_id        BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        title          VARCHAR(255)  NOT NULL,
+        description    VARCHAR(2000) NOT NULL,
+
+        status         VARCHAR(20) NOT NULL DEFAULT 'draft',
+        sort_order     INT NOT NULL DEFAULT 0,
+
+        created     TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updated     TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+        CHECK (status IN ('draft', 'published', 'archived'))
+    );
+    """
+
+    images_sql = f"""
+    CREATE TABLE IF NOT EXISTS {IMAGES_TABLE} (
+        image_id       BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        case_id        BIGINT NOT NULL REFERENCES cases(case_id) ON DELETE CASCADE,
+
+        tg_file_id     VARCHAR(300) NOT NULL,
+        media_type    VARCHAR(10) NOT NULL DEFAULT 'photo',
+
+        position       INT NOT NULL DEFAULT 0,
+        is_cover       BOOLEAN NOT NULL DEFAULT FALSE,
+
+        created     TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+
+    cases_order_idx_sql = f"""
+    CREATE INDEX IF NOT EXISTS idx_cases_status_order
+    ON {CASES_TABLE}(status, sort_order, created DESC, case_id DESC);
+    """
+
+    images_idx1_sql = f"""
+    CREATE INDEX IF NOT EXISTS idx_case_images_case_id
+    ON {IMAGES_TABLE}(case_id);
+    """
+
+    images_idx2_sql = f"""
+    CREATE INDEX IF NOT EXISTS idx_case_images_position
+    ON {IMAGES_TABLE}(case_id, position);
+    """
+
+    # user_events секционирована по created_at (см. ensure_event_partitions)
+    events_sql = f"""
+    CREATE TABLE IF NOT EXISTS {EVENTS_TABLE} (
+        event_id        BIGSERIAL,
+        user_id         BIGINT NOT NULL,
+        event_type      VARCHAR(64) NOT NULL,
+        event_context   VARCHAR(64),
+        event_value     VARCHAR(128),
+        payload         JSONB,
+        created_at      TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (event_id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    """
+
+    events_idx_user_sql = f"""
+    CREATE INDEX IF NOT EXISTS idx_user_events_user_id
+    ON {EVENTS_TABLE}(user_id);
+    """
+
+    events_idx_type_sql = f"""
+    CREATE INDEX IF NOT EXISTS idx_user_events_event_type
+    ON {EVENTS_TABLE}(event_type);
+    """
+
+    events_idx_created_sql = f"""
+    CREATE INDEX IF NOT EXISTS idx_user_events_created_at
+    ON {EVENTS_TABLE}(created_at);
+    """
+
+    # Дневные агрегаты событий для отчёта статистики (см. insert_events_bulk / rebuild_event_rollups)
+    events_daily_sql = f"""
+    CREATE TABLE IF NOT EXISTS {EVENTS_DAILY_TABLE} (
+        day             DATE NOT NULL,
+        event_type      VARCHAR(64) NOT NULL,
+        event_context   VARCHAR(64) NOT NULL DEFAULT '',
+        event_value     VARCHAR(128) NOT NULL DEFAULT '',
+        cnt             BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, event_type, event_context, event_value)
+    );
+    """
+
+    events_daily_users_sql = f"""
+    CREATE TABLE IF NOT EXISTS {EVENTS_DAILY_USERS_TABLE} (
+        day             DATE NOT NULL,
+        event_type      VARCHAR(64) NOT NULL,
+        user_id         BIGINT NOT NULL,
+        PRIMARY KEY (day, event_type, user_id)
+    );
+    """
+
+    events_daily_cases_sql = f"""
+    CREATE TABLE IF NOT EXISTS {EVENTS_DAILY_CASES_TABLE} (
+        day             DATE NOT NULL,
+        case_id         BIGINT NOT NULL,
+        event_type      VARCHAR(64) NOT NULL,
+        cnt             BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, event_type, case_id)
+    );
+    """
+
+    reviews_sql = """
+    CREATE TABLE IF NOT EXISTS case_reviews (
+        review_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        case_id BIGINT NOT NULL UNIQUE REFERENCES cases(case_id) ON DELETE CASCADE,
+        created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+
+    review_items_sql = """
+    CREATE TABLE IF NOT EXISTS case_review_items (
+        item_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        review_id BIGINT NOT NULL REFERENCES case_reviews(review_id) ON DELETE CASCADE,
+        tg_file_id VARCHAR(300),
+        media_type VARCHAR(20) NOT NULL,
+        text_content VARCHAR(4000),
+        position INT NOT NULL DEFAULT 0,
+        created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+
+    review_idx_sql = """
+    CREATE INDEX IF NOT EXISTS idx_case_reviews_case_id
+    ON case_reviews(case_id);
+    """
+
+    review_items_idx_sql = """
+    CREATE INDEX IF NOT EXISTS idx_case_review_items_review_id_position
+    ON case_review_items(review_id, position);
+    """
+
+    cta_sql = """
+    CREATE TABLE IF NOT EXISTS case_cta (
+        case_id BIGINT PRIMARY KEY REFERENCES cases(case_id) ON DELETE CASCADE,
+        button_text VARCHAR(64) NOT NULL DEFAULT 'Связаться со мной',
+        action_type VARCHAR(16) NOT NULL DEFAULT 'contact',
+        action_value VARCHAR(255),
+        updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+
+    settings_sql = """
+    CREATE TABLE IF NOT EXISTS bot_settings (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+
+    await session.execute(text(users_sql))
+    await session.execute(text(cases_sql))
+    await session.execute(text(images_sql))
+    await _ensure_events_table(session, events_sql)
+    await session.execute(text(events_daily_sql))
+    await session.execute(text(events_daily_users_sql))
+    await session.execute(text(events_daily_cases_sql))
+    await session.execute(text(reviews_sql))
+    await session.execute(text(review_items_sql))
+    await session.execute(text(review_idx_sql))
+    await session.execute(text(review_items_idx_sql))
+    await session.execute(text(cta_sql))
+    await session.execute(text(settings_sql))
+    await session.execute(text(
+        f"ALTER TABLE {IMAGES_TABLE} "
+        "ADD COLUMN IF NOT EXISTS media_type VARCHAR(10) NOT NULL DEFAULT 'photo';"
+    ))
+    await session.execute(text(cases_order_idx_sql))
+    await session.execute(text(images_idx1_sql))
+    await session.execute(text(images_idx2_sql))
+    await session.execute(text(events_idx_user_sql))
+    await session.execute(text(events_idx_type_sql))
+    await session.execute(text(events_idx_created_sql))
+
+
+# user_events: создаём секционированную таблицу или переводим на секции старую обычную
+async def _ensure_events_table(session, events_sql: str) -> None:
+    kind_res = await session.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table_name);"),
+        {"table_name": EVENTS_TABLE}
+    )
+    kind = kind_res.scalar_one_or_none()
+    legacy_table = f"{EVENTS_TABLE}_legacy"
+
+    if kind == "r":
+        # Разовая миграция старой несекционированной таблицы: переименовываем её вместе
+        # с индексами/последовательностью, создаём секционированную и переносим события в окне хранения
+        logger.info("Converting %s to a partitioned table", EVENTS_TABLE)
+        await session.execute(text(f"ALTER TABLE {EVENTS_TABLE} RENAME TO {legacy_table};"))
+        await session.execute(text(f"ALTER TABLE {legacy_table} RENAME CONSTRAINT {EVENTS_TABLE}_pkey TO {legacy_table}_pkey;"))
+        await session.execute(text(f"ALTER SEQUENCE IF EXISTS {EVENTS_TABLE}_event_id_seq RENAME TO {legacy_table}_event_id_seq;"))
+        for idx in ("user_id", "event_type", "created_at"):
+            await session.execute(text(f"DROP INDEX IF EXISTS idx_{EVENTS_TABLE}_{idx};"))
+
+    await session.execute(text(events_sql))
+    await session.execute(text(f"CREATE TABLE IF NOT EXISTS {EVENTS_DEFAULT_PARTITION} PARTITION OF {EVENTS_TABLE} DEFAULT;"))
+
+    if kind != "r":
+        await create_event_partitions(session, datetime.now())
+        return
+
+    retention_days = int(events_partition_settings["retention_days"])
+    where_sql = ""
+    params: Dict[str, Any] = {}
+    if retention_days > 0:
+        where_sql = "WHERE created_at >= LOCALTIMESTAMP - (INTERVAL '1 day' * :days)"
+        params["days"] = retention_days
+
+    min_res = await session.execute(text(f"SELECT MIN(created_at) FROM {legacy_table} {where_sql};"), params)
+    min_ts = min_res.scalar_one_or_none()
+    await create_event_partitions(session, min_ts or datetime.now())
+    await session.execute(text(f"""
+        INSERT INTO {EVENTS_TABLE} (event_id, user_id, event_type, event_context, event_value, payload, created_at)
+        SELECT event_id, user_id, event_type, event_context, event_value, payload, created_at
+        FROM {legacy_table}
+        {where_sql};
+    """), params)
+    await session.execute(text(f"""
+        SELECT setval(
+            pg_get_serial_sequence('{EVENTS_TABLE}', 'event_id'),
+            GREATEST((SELECT COALESCE(MAX(event_id), 0) FROM {legacy_table}), 1)
+        );
+    """))
+    await session.execute(text(f"DROP TABLE {legacy_table};"))
+
+
+# 2. Разовый пересчёт дневных агрегатов по уже накопленным событиям
+async def _m0002_event_rollups_backfill(session) -> None:
+    # раньше пересчёт отмечался флагом в bot_settings — повторно не считаем
+    res = await session.execute(text("SELECT value FROM bot_settings WHERE key = 'events_rollup_ready';"))
+    if res.scalar_one_or_none() == "1":
+        return
+    # колонки user_events.case_id на этом шаге ещё нет (см. шаг 3);
+    # first_at (шаг 11) пересчёт уже пишет, поэтому колонку добавляем здесь же
+    await session.execute(text(f"ALTER TABLE {EVENTS_DAILY_USERS_TABLE} ADD COLUMN IF NOT EXISTS first_at TIMESTAMP;"))
+    await rebuild_event_rollups_in(session, case_id_sql=_LEGACY_CASE_ID_SQL)
+
+
+# 3. Типизированный case_id в user_events вместо разбора event_value
+async def _m0003_events_case_id(session) -> None:
+    await session.execute(text(f"ALTER TABLE {EVENTS_TABLE} ADD COLUMN IF NOT EXISTS case_id BIGINT;"))
+    await session.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS idx_user_events_case_id_created
+        ON {EVENTS_TABLE}(case_id, created_at)
+        WHERE case_id IS NOT NULL;
+    """))
+    await session.commit()
+
+    # заполняем старые события пачками по event_id (keyset), каждая пачка — своя короткая транзакция;
+    # пройденный event_id пишется в bot_settings в той же транзакции — повторный запуск продолжит с него,
+    # строки, которым case_id не нужен, второй раз не читаются.
+    # Верхней границы нет: идём до пустой пачки, так что события, которые старый код пишет без case_id
+    # во время migrate.py перед деплоем, тоже заполняются
+    case_types = ", ".join(f"'{t}'" for t in CASE_EVENT_TYPES)
+    backfill_sql = text(f"""
+        WITH batch AS (
+            SELECT event_id, created_at
+            FROM {EVENTS_TABLE}
+            WHERE event_id > :last_id
+            ORDER BY event_id
+            LIMIT :batch_size
+        ),
+        upd AS (
+            UPDATE {EVENTS_TABLE} e
+            SET case_id = CASE
+                WHEN e.payload->>'case_id' ~ '^[0-9]{{1,18}}$' THEN (e.payload->>'case_id')::BIGINT
+                ELSE e.event_value::BIGINT
+            END
+            FROM batch b
+            WHERE e.event_id = b.event_id
+              AND e.created_at = b.created_at
+              AND e.case_id IS NULL
+              AND (
+                  (e.event_type IN ({case_types}) AND e.event_value ~ '^[0-9]{{1,18}}$')
+                  OR e.payload->>'case_id' ~ '^[0-9]{{1,18}}$'
+              )
+            RETURNING 1
+        )
+        SELECT (SELECT MAX(event_id) FROM batch) AS last_id, (SELECT COUNT(*) FROM upd) AS updated;
+    """)
+    progress_sql = text("""
+        INSERT INTO bot_settings (key, value, updated_at)
+        VALUES (:key, :value, CURRENT_TIMESTAMP)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP;
+    """)
+
+    res = await session.execute(text("SELECT value FROM bot_settings WHERE key = :key;"), {"key": _CASE_ID_BACKFILL_KEY})
+    last_id = int(res.scalar_one_or_none() or 0)
+    total = 0
+    while True:
+        res = await session.execute(backfill_sql, {"last_id": last_id, "batch_size": EVENTS_BACKFILL_BATCH})
+        row = res.fetchone()
+        if row.last_id is None:
+            break
+        last_id = int(row.last_id)
+        total += int(row.updated)
+        await session.execute(progress_sql, {"key": _CASE_ID_BACKFILL_KEY, "value": str(last_id)})
+        await session.commit()
+    logger.info("user_events.case_id backfilled: %s rows", total)
+    await session.execute(text("DELETE FROM bot_settings WHERE key = :key;"), {"key": _CASE_ID_BACKFILL_KEY})
+
+
+# 4. Индексы под форму отчётных запросов: event_type = ... AND время в диапазоне
+async def _m0004_analytics_indexes(session) -> None:
+    await session.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS idx_user_events_type_created
+        ON {EVENTS_TABLE}(event_type, created_at);
+    """))
+    # события только дописываются, created_at растёт вместе с физическим порядком строк —
+    # BRIN на порядки меньше btree и почти не дорожает на вставке
+    await session.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS idx_user_events_created_brin
+        ON {EVENTS_TABLE} USING BRIN (created_at);
+    """))
+    # одиночные btree перекрыты составным индексом и BRIN, а стоят на каждой вставке
+    await session.execute(text("DROP INDEX IF EXISTS idx_user_events_event_type;"))
+    await session.execute(text("DROP INDEX IF EXISTS idx_user_events_created_at;"))
+
+    # дневные агрегаты читаются так же: event_type = ... AND day >= ...
+    await session.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS idx_user_events_daily_type_day
+        ON {EVENTS_DAILY_TABLE}(event_type, day);
+    """))
+    await session.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS idx_user_events_daily_users_type_day
+        ON {EVENTS_DAILY_USERS_TABLE}(event_type, day, user_id);
+    """))
+    await session.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS idx_user_events_daily_cases_type_day
+        ON {EVENTS_DAILY_CASES_TABLE}(event_type, day, case_id);
+    """))
+
+
+# 5. users_reg.last_activity вместо агрегата по всем событиям в отчёте
+async def _m0005_users_last_activity(session) -> None:
+    await session.execute(text(f"ALTER TABLE {USERS_TABLE} ADD COLUMN IF NOT EXISTS last_activity TIMESTAMP;"))
+    await session.execute(text(f"""
+        UPDATE {USERS_TABLE} u
+        SET last_activity = t.last_at
+        FROM (
+            SELECT user_id, MAX(created_at) AS last_at
+            FROM {EVENTS_TABLE}
+            GROUP BY user_id
+        ) t
+        WHERE u.user_id = t.user_id
+          AND (u.last_activity IS NULL OR u.last_activity < t.last_at);
+    """))
+    await session.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS idx_users_reg_last_activity
+        ON {USERS_TABLE}(last_activity DESC NULLS LAST);
+    """))
+
+
+# 6. Таблица FSM-хранилища aiogram (db_handler/fsm_storage.py)
+async def _m0006_fsm_storage(session) -> None:
+    await session.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {FSM_TABLE} (
+            key         TEXT PRIMARY KEY,
+            state       TEXT,
+            data        JSONB NOT NULL DEFAULT '{{}}'::jsonb,
+            updated_at  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """))
+
+
+# 7. file_id статичных картинок экранов (handlers/services/assets_service.py)
+async def _m0007_static_assets(session) -> None:
+    await session.execute(text("""
+        CREATE TABLE IF NOT EXISTS static_assets (
+            content_hash  CHAR(64) PRIMARY KEY,
+            path          VARCHAR(255) NOT NULL,
+            file_id       VARCHAR(300) NOT NULL,
+            updated_at    TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """))
+
+
+# 8. Рассылки (handlers/services/broadcast_service.py): задание, статус доставки по получателю,
+#    users_reg.is_active — False для заблокировавших бота
+async def _m0008_broadcasts(session) -> None:
+    await session.execute(text(f"ALTER TABLE {USERS_TABLE} ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE;"))
+    await session.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {BROADCASTS_TABLE} (
+            broadcast_id  BIGSERIAL PRIMARY KEY,
+            created_by    BIGINT NOT NULL,
+            chat_id       BIGINT NOT NULL,
+            content       JSONB NOT NULL,
+            status        VARCHAR(16) NOT NULL DEFAULT 'running',
+            total         INT NOT NULL DEFAULT 0,
+            sent          INT NOT NULL DEFAULT 0,
+            failed        INT NOT NULL DEFAULT 0,
+            blocked       INT NOT NULL DEFAULT 0,
+            created_at    TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            finished_at   TIMESTAMP
+        );
+    """))
+    await session.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {BROADCAST_RECIPIENTS_TABLE} (
+            broadcast_id  BIGINT NOT NULL REFERENCES {BROADCASTS_TABLE}(broadcast_id) ON DELETE CASCADE,
+            user_id       BIGINT NOT NULL,
+            status        VARCHAR(16) NOT NULL,
+            error         VARCHAR(255),
+            sent_at       TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (broadcast_id, user_id)
+        );
+    """))
+    await session.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS idx_broadcasts_status
+        ON {BROADCASTS_TABLE}(status);
+    """))
+
+
+# 9. fsm_storage.version: запись FSM-данных не затирает более новую строку другого процесса
+async def _m0009_fsm_storage_version(session) -> None:
+    await session.execute(text(f"ALTER TABLE {FSM_TABLE} ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;"))
+
+
+# 10. Индекс под список кейсов админки (без фильтра по статусу) в порядке keyset-пагинации
+async def _m0010_cases_order_index(session) -> None:
+    await session.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS idx_cases_order
+        ON {CASES_TABLE}(sort_order, created DESC, case_id DESC);
+    """))
+
+
+# 11. Время первого события пользователя за день: порядок шагов воронки внутри одного дня
+async def _m0011_daily_users_first_at(session) -> None:
+    await session.execute(text(f"ALTER TABLE {EVENTS_DAILY_USERS_TABLE} ADD COLUMN IF NOT EXISTS first_at TIMESTAMP;"))
+    # читаем сырые события только с первого дня, где first_at ещё пуст
+    await session.execute(text(f"""
+        UPDATE {EVENTS_DAILY_USERS_TABLE} d
+        SET first_at = t.first_at
+        FROM (
+            SELECT created_at::date AS day, event_type, user_id, MIN(created_at) AS first_at
+            FROM {EVENTS_TABLE}
+            WHERE created_at >= (SELECT MIN(day) FROM {EVENTS_DAILY_USERS_TABLE} WHERE first_at IS NULL)
+            GROUP BY 1, 2, 3
+        ) t
+        WHERE d.day = t.day
+          AND d.event_type = t.event_type
+          AND d.user_id = t.user_id
+          AND d.first_at IS NULL;
+    """))
+
+
+MIGRATIONS: List[Migration] = [
+    (1, "base schema", _m0001_base_schema),
+    (2, "event rollups backfill", _m0002_event_rollups_backfill),
+    (3, "user_events.case_id", _m0003_events_case_id),
+    (4, "analytics indexes", _m0004_analytics_indexes),
+    (5, "users_reg.last_activity", _m0005_users_last_activity),
+    (6, "fsm storage", _m0006_fsm_storage),
+    (7, "static assets", _m0007_static_assets),
+    (8, "broadcasts", _m0008_broadcasts),
+    (9, "fsm storage version", _m0009_fsm_storage_version),
+    (10, "cases order index", _m0010_cases_order_index),
+    (11, "user_events_daily_users.first_at", _m0011_daily_users_first_at),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# Сессионная блокировка на отдельном соединении держится весь прогон, в том числе через
+# промежуточные коммиты шагов (backfill пачками); снимается явно или при закрытии соединения
+@asynccontextmanager
+async def _migrations_lock() -> AsyncIterator[None]:
+    engine = await open_pool()
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("SELECT pg_advisory_lock(:key);"), {"key": _MIGRATIONS_LOCK_KEY})
+        try:
+            yield
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key);"), {"key": _MIGRATIONS_LOCK_KEY})
+
+
+async def _ensure_version_table(session) -> None:
+    await session.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} (
+            version     INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """))
+
+
+async def _read_version(session) -> int:
+    res = await session.execute(text(f"SELECT COALESCE(MAX(version), 0) FROM {SCHEMA_VERSION_TABLE};"))
+    return int(res.scalar_one())
+
+
+# Текущая версия схемы без DDL: 0 — база ещё не размечена
+async def get_schema_version() -> int:
+    async with db_session() as session:
+        exists_res = await session.execute(
+            text("SELECT to_regclass(:table_name) IS NOT NULL;"),
+            {"table_name": SCHEMA_VERSION_TABLE}
+        )
+        if not exists_res.scalar_one():
+            return 0
+        return await _read_version(session)
+
+
+# Применяем недостающие шаги по порядку; если схема актуальна — только одно чтение версии
+async def apply_migrations(target: int | None = None) -> List[int]:
+    target = LATEST_VERSION if target is None else target
+    if await get_schema_version() >= target:
+        return []
+
+    applied: List[int] = []
+    async with _migrations_lock():
+        for version, description, step in MIGRATIONS:
+            if version > target:
+                break
+            async with db_session() as session:
+                await _ensure_version_table(session)
+                # шаг мог применить другой процесс, пока мы ждали блокировку
+                if await _read_version(session) >= version:
+                    await session.rollback()
+                    continue
+                logger.info("Applying migration %s: %s", version, description)
+                await step(session)
+                await session.execute(
+                    text(f"""
+                        INSERT INTO {SCHEMA_VERSION_TABLE} (version, description)
+                        VALUES (:version, :description)
+                        ON CONFLICT (version) DO NOTHING;
+                    """),
+                    {"version": version, "description": description}
+                )
+                await session.commit()
+                applied.append(version)
+    return applied
+
+
+# Список шагов с признаком применённости (для CLI)
+async def get_migrations_status() -> List[Dict[str, Any]]:
+    current = await get_schema_version()
+    return [
+        {"version": version, "description": description, "applied": version <= current}
+        for version, description, _ in MIGRATIONS
+    ]
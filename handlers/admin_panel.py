@@ -4,13 +4,17 @@ from aiogram.types import CallbackQuery, Message, FSInputFile, InputMediaPhoto,
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from create_bot import admins
-from keyboards.kbs import admin_panel_kb, admin_cases_kb, admin_case_editor_kb, admin_cancel_case_edit_kb, settings_kb, confirm_kb, admin_cancel_review_edit_kb, admin_cancel_cta_edit_kb, admin_cta_type_kb
-from db_handler.db_funk import get_user_count, get_cases_page, create_case_draft, get_case_by_id, update_case_field, add_case_images, add_case_media, get_case_images, delete_case_images, log_event, get_setting, set_setting, upsert_case_review, upsert_case_cta, get_case_cta
+from keyboards.kbs import admin_panel_kb, admin_cases_kb, admin_case_editor_kb, admin_cancel_case_edit_kb, settings_kb, confirm_kb, admin_cancel_review_edit_kb, admin_cancel_cta_edit_kb, admin_cta_type_kb, broadcast_kb, broadcast_cancel_kb
+from db_handler.db_funk import get_user_count, get_cases_page, create_case_draft, get_case_by_id, get_case_bundle, update_case_field, add_case_media, delete_case_images, log_event, upsert_case_review, upsert_case_cta, get_case_cta, get_active_user_count, create_broadcast, get_last_broadcast
 from handlers.user_router import delete_event_message
 from handlers.services.statistics_service import generate_statistics_report_file
 from handlers.services.bot_control_service import request_restart
 from handlers.services.system_status_service import get_system_status
 from handlers.services.statistics_files_service import cleanup_statistics_reports
+from handlers.services.settings_service import get_cached_setting, update_setting
+from handlers.services.message_cleanup_service import schedule_delete
+from handlers.services.assets_service import answer_asset_photo
+from handlers.services.broadcast_service import BroadcastProgress, content_from_message, format_progress, get_progress, send_content, start_broadcast, stop_broadcast
 import asyncio
 import logging
 import time
@@ -52,31 +56,29 @@ class CaseEdit(StatesGroup):
     waiting_cta_url = State()
 
 
+class BroadcastEdit(StatesGroup):
+    waiting_content = State()
+
+
 # ------------------------------------------------------------------------ Хелпер вытягивает обложку -------------------------------------------------------------
 
-async def render_case_editor(message_obj, state: FSMContext, case_id: int, back_page: int = 0, note: str | None = None):
-    case = await get_case_by_id(case_id)
-    if not case:
+async def render_case_editor(message_obj, state: FSMContext, case_id: int, back_page: str = "", note: str | None = None):
+    bundle = await get_case_bundle(case_id)
+    if not bundle:
         # админ | редактор кейса | кейс не найден
         await message_obj.answer("Кейс не найден")
         return
+    case = bundle["case"]
 
     # 0) удалить предыдущий альбом редактора (если есть)
     data = await state.get_data()
     prev_card_id = data.get("case_editor_card_message_id")
     prev_prompt_id = data.get("prompt_message_id")
-    for mid in (prev_card_id, prev_prompt_id):
-        if mid:
-            try:
-                await message_obj.bot.delete_message(chat_id=message_obj.chat.id, message_id=mid)
-            except TelegramBadRequest:
-                pass
-            except Exception:
-                pass
+    schedule_delete(message_obj.bot, message_obj.chat.id, [prev_card_id, prev_prompt_id])
     await state.update_data(case_editor_card_message_id=None, prompt_message_id=None)
     await delete_last_case_album(state, message_obj.bot, message_obj.chat.id)
 
-    images = await get_case_images(case_id)
+    images = bundle["media"]
 
     caption = (
         f"<b>Редактор кейса</b>\n\n"
@@ -104,9 +106,9 @@ async def render_case_editor(message_obj, state: FSMContext, case_id: int, back_
         album_ids = [m.message_id for m in album_msgs]
         await state.update_data(case_editor_album_ids=album_ids)
     else:
-        photo = FSInputFile("src/images/admin.png")
+        photo = "src/images/admin.png"
         # админ | редактор кейса | показать заглушку 'Нет изображений кейса (пока)'
-        msg = await message_obj.answer_photo(photo=photo, caption="Нет изображений кейса (пока)")
+        msg = await answer_asset_photo(message_obj, photo, caption="Нет изображений кейса (пока)")
         await state.update_data(case_editor_album_ids=[msg.message_id])
 
     # 2) панель управления отдельным сообщением
@@ -133,13 +135,8 @@ async def delete_last_case_album(state: FSMContext, bot, chat_id: int):
     if not album_ids:
         return
 
-    for mid in album_ids:
-        try:
-            await bot.delete_message(chat_id=chat_id, message_id=mid)
-        except TelegramBadRequest:
-            pass
-        except Exception:
-            pass
+    # альбом до 10 сообщений — один deleteMessages в фоне
+    schedule_delete(bot, chat_id, album_ids)
 
     await state.update_data(case_editor_album_ids=[])
 
@@ -148,14 +145,7 @@ async def cleanup_admin_messages(state: FSMContext, bot, chat_id: int):
     data = await state.get_data()
     card_id = data.get("case_editor_card_message_id")
     prompt_id = data.get("prompt_message_id")
-    for mid in (card_id, prompt_id):
-        if mid:
-            try:
-                await bot.delete_message(chat_id=chat_id, message_id=mid)
-            except TelegramBadRequest:
-                pass
-            except Exception:
-                pass
+    schedule_delete(bot, chat_id, [card_id, prompt_id])
     await state.update_data(case_editor_card_message_id=None, prompt_message_id=None)
 
 
@@ -184,21 +174,41 @@ async def is_action_throttled(state: FSMContext, action: str, cooldown: float =
 
 
 async def render_settings_screen(message_obj):
-    maintenance = await get_setting("maintenance", "0")
+    maintenance = get_cached_setting("maintenance", "0")
     maintenance_enabled = maintenance == "1"
-    photo = FSInputFile("src/images/admin.png")
+    photo = "src/images/admin.png"
     caption = (
         "<b>Настройки бота</b>\n\n"
         f"Техработы: <b>{'ВКЛ' if maintenance_enabled else 'ВЫКЛ'}</b>"
     )
     # админ | настройки | показать экран настроек
-    await message_obj.answer_photo(
-        photo=photo,
+    await answer_asset_photo(
+        message_obj,
+        photo,
         caption=caption,
         reply_markup=settings_kb(maintenance_enabled)
     )
 
 
+async def render_broadcast_screen(message_obj):
+    last = await get_last_broadcast()
+    active_users = await get_active_user_count()
+    caption = f"<b>Рассылка</b>\n\nАктивных пользователей: <b>{active_users}</b>"
+    running_id = None
+    if last:
+        progress = get_progress(last["broadcast_id"]) or BroadcastProgress(last)
+        caption += "\n\n" + format_progress(progress)
+        if last["status"] == "running":
+            running_id = last["broadcast_id"]
+    # админ | рассылка | показать экран рассылки
+    await answer_asset_photo(
+        message_obj,
+        "src/images/admin.png",
+        caption=caption,
+        reply_markup=broadcast_kb(running_id)
+    )
+
+
 # ------------------------------------------------------------------------ Основная админ панель -----------------------------------------------------------------
 @admin_router.callback_query(F.data.startswith("admin:"))
 async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
@@ -212,7 +222,11 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
     await cleanup_admin_messages(state, callback.bot, chat_id)
     await delete_last_case_album(state, callback.bot, chat_id)
 
-    if not (section == "cases" and action in ("edit_title", "edit_desc", "edit_cancel", "edit_cover", "cover_done", "review", "review_done", "review_cancel", "cta", "cta_type", "cta_cancel")):
+    keep_state = (
+        (section == "cases" and action in ("edit_title", "edit_desc", "edit_cancel", "edit_cover", "cover_done", "review", "review_done", "review_cancel", "cta", "cta_type", "cta_cancel"))
+        or (section == "broadcast" and action == "confirm")
+    )
+    if not keep_state:
         await state.clear()
 
 
@@ -225,11 +239,12 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
     if section == "main":
         await safe_log_event(callback.from_user.id, "admin_open", "admin_main")
         users_count = await get_user_count()
-        photo = FSInputFile("src/images/admin.png")
+        photo = "src/images/admin.png"
         await safe_delete_event_message(callback)
         # админ | главное меню | показать основное меню администратора
-        await callback.message.answer_photo(
-            photo = photo,
+        await answer_asset_photo(
+            callback.message,
+            photo,
             caption = 'Основное меню администратора',
             reply_markup = admin_panel_kb(users_count)
         )
@@ -263,10 +278,11 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
                 pass
 
         users_count = await get_user_count()
-        photo = FSInputFile("src/images/admin.png")
+        photo = "src/images/admin.png"
         # админ | статистика | показать статистику
-        await callback.message.answer_photo(
-            photo=photo,
+        await answer_asset_photo(
+            callback.message,
+            photo,
             caption="Статистика",
             reply_markup=admin_panel_kb(users_count)
         )
@@ -340,9 +356,9 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
             # админ | настройки | прогресс: выполняю
             progress_msg = await callback.message.answer("Выполняю…")
             try:
-                current = await get_setting("maintenance", "0")
+                current = get_cached_setting("maintenance", "0")
                 new_value = "0" if current == "1" else "1"
-                await set_setting("maintenance", new_value)
+                await update_setting("maintenance", new_value)
                 await progress_msg.edit_text("Готово ✅")
             except Exception:
                 await progress_msg.edit_text("Ошибка ❌")
@@ -388,34 +404,84 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
         return
     
 
+    if section == "broadcast":
+        await safe_log_event(callback.from_user.id, "admin_nav", "broadcast", event_value=action, payload={"callback": callback.data})
+        # сообщение с прогрессом рассылки не удаляем — его дальше обновляет broadcast_service
+        progress = get_progress(int(payload)) if action == "stop" and payload and payload.isdigit() else None
+        if progress is None or progress.message_id != callback.message.message_id:
+            await safe_delete_event_message(callback)
+        if action is None:
+            await render_broadcast_screen(callback.message)
+            return
+
+        if action == "new":
+            await state.set_state(BroadcastEdit.waiting_content)
+            # админ | рассылка | подсказка: прислать сообщение для рассылки
+            msg = await callback.message.answer(
+                "✉️ Пришли сообщение для рассылки: текст, фото, видео, GIF или документ (с подписью).",
+                reply_markup=broadcast_cancel_kb()
+            )
+            await state.update_data(prompt_message_id=msg.message_id)
+            return
+
+        if action == "confirm":
+            if await is_action_throttled(state, "broadcast_confirm"):
+                # админ | рассылка | подтверждение нажатия
+                await callback.answer()
+                return
+            data = await state.get_data()
+            content = data.get("broadcast_content")
+            await state.clear()
+            if not content:
+                # админ | рассылка | черновик потерян
+                await callback.message.answer("Черновик рассылки потерян, создай заново")
+                await render_broadcast_screen(callback.message)
+                return
+            broadcast_id = await create_broadcast(callback.from_user.id, chat_id, content)
+            # прогресс рассылка присылает отдельным сообщением и обновляет его сама
+            await start_broadcast(callback.bot, broadcast_id)
+            return
+
+        if action == "discard":
+            # админ | рассылка | отмена
+            await callback.message.answer("Отменено")
+            await render_broadcast_screen(callback.message)
+            return
+
+        if action == "stop" and payload and payload.isdigit():
+            await stop_broadcast(int(payload))
+            # админ | рассылка | остановка
+            await callback.answer("Останавливаю рассылку")
+            if progress is None:
+                await render_broadcast_screen(callback.message)
+            return
+
+        # админ | навигация | неизвестная команда (уведомление)
+        await callback.answer("Неизвестная команда", show_alert=True)
+        return
+
+
     if section == "cases":
-        photo = FSInputFile("src/images/admin.png")
+        photo = "src/images/admin.png"
         action = action or "list"
 
         if action in ("list", None):
             await safe_log_event(callback.from_user.id, "admin_nav", "cases", event_value=action, payload={"callback": callback.data})
 
         if action == "list":
-            try:
-                page = int(payload) if payload is not None else 0
-            except ValueError:
-                page = 0
-
-            cases = await get_cases_page(page=page, limit=PAGE_SIZE + 1)
-            has_next = len(cases) > PAGE_SIZE
-            cases = cases[:PAGE_SIZE]
-            has_prev = page > 0
+            cases_page = await get_cases_page(cursor=payload or "", limit=PAGE_SIZE)
 
             await safe_delete_event_message(callback)
             # админ | кейсы | показать список кейсов для управления
-            await callback.message.answer_photo(
-                photo=photo,
+            await answer_asset_photo(
+                callback.message,
+                photo,
                 caption="Управление кейсами",
                 reply_markup=admin_cases_kb(
-                    cases=cases,
-                    page=page,
-                    has_prev=has_prev,
-                    has_next=has_next
+                    cases=cases_page["items"],
+                    cursor=cases_page["cursor"],
+                    prev_cursor=cases_page["prev_cursor"],
+                    next_cursor=cases_page["next_cursor"]
                 )
             )
             return
@@ -438,16 +504,16 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
             )
 
             await safe_delete_event_message(callback)
-            await render_case_editor(callback.message, state=state, case_id=case["case_id"], back_page=0)
+            await render_case_editor(callback.message, state=state, case_id=case["case_id"], back_page="")
             return
 
         if action == "view":
-            back_page = 0
+            back_page = ""
             try:
                 if payload and "|" in payload:
                     case_id_str, back_page_str = payload.split("|", 1)
                     case_id = int(case_id_str)
-                    back_page = int(back_page_str)
+                    back_page = back_page_str
                 else:
                     case_id = int(payload) if payload is not None else 0
             except ValueError:
@@ -488,7 +554,7 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
 
             try:
                 case_id = int(case_id_str)
-                back_page = int(back_page_str)
+                back_page = back_page_str
             except ValueError:
                 # админ | кейсы | некорректные данные
                 await callback.answer("Некорректные данные", show_alert=True)
@@ -544,7 +610,7 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
             case_id_str, back_page_str = payload.split("|", 1)
             try:
                 case_id = int(case_id_str)
-                back_page = int(back_page_str)
+                back_page = back_page_str
             except ValueError:
                 # админ | ответы | некорректные данные
                 await callback.answer("Некорректные данные", show_alert=True)
@@ -578,7 +644,7 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
             case_id_str, back_page_str = payload.split("|", 1)
             try:
                 case_id = int(case_id_str)
-                back_page = int(back_page_str)
+                back_page = back_page_str
             except ValueError:
                 # админ | отзывы | некорректные данные
                 await callback.answer("Некорректные данные", show_alert=True)
@@ -600,7 +666,7 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
             case_id_str, back_page_str = payload.split("|", 1)
             try:
                 case_id = int(case_id_str)
-                back_page = int(back_page_str)
+                back_page = back_page_str
             except ValueError:
                 # админ | отзывы | некорректные данные
                 await callback.answer("Некорректные данные", show_alert=True)
@@ -631,7 +697,7 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
             case_id_str, back_page_str = payload.split("|", 1)
             try:
                 case_id = int(case_id_str)
-                back_page = int(back_page_str)
+                back_page = back_page_str
             except ValueError:
                 # админ | CTA | некорректные данные
                 await callback.answer("Некорректные данные", show_alert=True)
@@ -668,7 +734,7 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
             case_id_str, back_page_str = payload.split("|", 1)
             try:
                 case_id = int(case_id_str)
-                back_page = int(back_page_str)
+                back_page = back_page_str
             except ValueError:
                 # админ | CTA | некорректные данные
                 await callback.answer("Некорректные данные", show_alert=True)
@@ -719,7 +785,7 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
             case_id_str, back_page_str = payload.split("|", 1)
             try:
                 case_id = int(case_id_str)
-                back_page = int(back_page_str)
+                back_page = back_page_str
             except ValueError:
                 # админ | CTA | некорректные данные
                 await callback.answer("Некорректные данные", show_alert=True)
@@ -742,7 +808,7 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
 
             try:
                 case_id = int(case_id_str)
-                back_page = int(back_page_str)
+                back_page = back_page_str
             except ValueError:
                 # админ | редактирование | некорректные данные
                 await callback.answer("Некорректные данные", show_alert=True)
@@ -785,7 +851,7 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
             case_id_str, back_page_str = payload.split("|", 1)
             try:
                 case_id = int(case_id_str)
-                back_page = int(back_page_str)
+                back_page = back_page_str
             except ValueError:
                 # админ | редактирование | некорректные данные
                 await callback.answer("Некорректные данные", show_alert=True)
@@ -828,7 +894,7 @@ async def open_admin_panel(callback: CallbackQuery, state: FSMContext):
 
             try:
                 case_id = int(case_id_str)
-                back_page = int(back_page_str)
+                back_page = back_page_str
             except ValueError:
                 # админ | публикация | некорректные данные
                 await callback.answer("Некорректные данные", show_alert=True)
@@ -895,7 +961,7 @@ async def save_case_field(message: Message, state: FSMContext):
     prompt_message_id = data.get("prompt_message_id")
     case_id = data.get("case_id")
     field = data.get("field")
-    back_page = data.get("back_page", 0)
+    back_page = data.get("back_page", "")
     if not case_id or field not in ("title", "description", "cover"):
         await state.clear()
         # админ | редактирование | состояние потеряно
@@ -991,7 +1057,7 @@ async def save_case_review(message: Message, state: FSMContext):
 
     data = await state.get_data()
     case_id = data.get("case_id")
-    back_page = data.get("back_page", 0)
+    back_page = data.get("back_page", "")
     items = data.get("review_items", [])
 
     async def warn_and_cleanup(text: str):
@@ -1056,7 +1122,7 @@ async def save_cta_text(message: Message, state: FSMContext):
 
     data = await state.get_data()
     case_id = data.get("case_id")
-    back_page = data.get("back_page", 0)
+    back_page = data.get("back_page", "")
     prompt_message_id = data.get("prompt_message_id")
     if not case_id:
         await state.clear()
@@ -1104,7 +1170,7 @@ async def save_cta_url(message: Message, state: FSMContext):
 
     data = await state.get_data()
     case_id = data.get("case_id")
-    back_page = data.get("back_page", 0)
+    back_page = data.get("back_page", "")
     prompt_message_id = data.get("prompt_message_id")
     cta_text = data.get("cta_text")
     if not case_id or not cta_text:
@@ -1136,3 +1202,35 @@ async def save_cta_url(message: Message, state: FSMContext):
     await state.clear()
     await render_case_editor(message, state=state, case_id=case_id, back_page=back_page, note="✅ Кнопка обновлена")
 
+
+@admin_router.message(BroadcastEdit.waiting_content)
+async def save_broadcast_content(message: Message, state: FSMContext):
+    if message.from_user.id not in admins:
+        await state.clear()
+        return
+
+    content = content_from_message(message)
+    if content is None:
+        # админ | рассылка | неподдерживаемый тип сообщения
+        await message.answer("Такое сообщение не разослать. Пришли текст, фото, видео, GIF или документ, или нажми ✖️ Отмена.")
+        return
+
+    data = await state.get_data()
+    schedule_delete(message.bot, message.chat.id, [data.get("prompt_message_id"), message.message_id])
+    # черновик остаётся в данных FSM до подтверждения, ожидание ввода снимаем
+    await state.set_state(None)
+    await state.update_data(broadcast_content=content, prompt_message_id=None)
+
+    # админ | рассылка | предпросмотр сообщения
+    preview = await send_content(message.bot, message.chat.id, content)
+    await state.update_data(prompt_message_id=preview.message_id)
+    active_users = await get_active_user_count()
+    # админ | рассылка | подтверждение отправки
+    await message.answer(
+        f"Разослать это сообщение {active_users} пользователям?",
+        reply_markup=confirm_kb(
+            confirm_data="admin:broadcast:confirm",
+            cancel_data="admin:broadcast:discard",
+            confirm_text="Отправить"
+        )
+    )
@@ -0,0 +1,87 @@
+import hashlib
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+from db_handler.db_funk import delete_static_asset, get_static_assets, upsert_static_asset
+
+# Статичные картинки экранов (src/images/*.png) загружаются в Telegram один раз:
+# file_id из ответа сохраняется по sha256 содержимого, дальше отправляется по file_id.
+# Изменился файл — другой хэш, картинка загрузится заново; Telegram отклонил id — тоже.
+
+_file_ids: Dict[str, str] = {}
+# path -> (mtime, size, sha256): файл перечитывается, только если изменились mtime/размер
+_hashes: Dict[str, Tuple[float, int, str]] = {}
+
+
+async def load_assets() -> None:
+    global _file_ids
+    try:
+        _file_ids = await get_static_assets()
+    except Exception:
+        logging.exception("STATIC ASSETS LOAD ERROR")
+
+
+def _content_hash(path: str) -> str:
+    stat = os.stat(path)
+    cached = _hashes.get(path)
+    if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+    _hashes[path] = (stat.st_mtime, stat.st_size, content_hash)
+    return content_hash
+
+
+def _is_file_id_error(e: TelegramBadRequest) -> bool:
+    text = str(e).lower()
+    return "file" in text or "identifier" in text
+
+
+async def _remember(content_hash: str, path: str, message: Message) -> None:
+    if not message.photo:
+        return
+    file_id = message.photo[-1].file_id
+    _file_ids[content_hash] = file_id
+    try:
+        await upsert_static_asset(content_hash, path, file_id)
+    except Exception:
+        logging.exception("STATIC ASSET SAVE ERROR (%s)", path)
+
+
+async def _forget(content_hash: str) -> None:
+    _file_ids.pop(content_hash, None)
+    try:
+        await delete_static_asset(content_hash)
+    except Exception:
+        logging.exception("STATIC ASSET DELETE ERROR")
+
+
+# answer_photo для статичной картинки: по file_id, если он есть, иначе загрузка файла
+async def answer_asset_photo(message_obj, path: str, **kwargs) -> Message:
+    content_hash: Optional[str] = None
+    try:
+        content_hash = _content_hash(path)
+    except OSError:
+        logging.exception("STATIC ASSET READ ERROR (%s)", path)
+
+    file_id = _file_ids.get(content_hash) if content_hash else None
+    if file_id:
+        try:
+            return await message_obj.answer_photo(photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            if not _is_file_id_error(e):
+                raise
+            logging.warning("STATIC ASSET file_id rejected (%s): %s", path, e)
+            await _forget(content_hash)
+
+    msg = await message_obj.answer_photo(photo=FSInputFile(path), **kwargs)
+    if content_hash:
+        await _remember(content_hash, path, msg)
+    return msg
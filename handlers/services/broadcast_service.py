@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import Message
+
+from create_bot import broadcast_settings
+from db_handler.db_funk import (
+    get_broadcast, get_broadcast_recipients, get_running_broadcasts, save_broadcast_results, set_broadcast_status
+)
+from keyboards.kbs import broadcast_progress_kb
+from middlewares.rate_limit import TokenBucket
+
+# Рассылка по users_reg: получатели читаются пачками (keyset по user_id), отправка идёт
+# со скоростью BROADCAST_RATE, медиа — по file_id из сообщения админа, без повторной загрузки.
+# Статус каждого получателя пишется в broadcast_recipients после пачки, поэтому после
+# перезапуска рассылка продолжается с неотправленных (отправленные в момент падения
+# могут получить сообщение повторно). Заблокировавшие бота помечаются is_active = FALSE.
+
+STATUS_TITLES = {
+    "running": "идёт",
+    "paused": "приостановлена, продолжится после перезапуска",
+    "done": "завершена",
+    "cancelled": "остановлена",
+}
+
+_tasks: Dict[int, asyncio.Task] = {}
+_progress: Dict[int, "BroadcastProgress"] = {}
+
+
+class BroadcastProgress:
+    def __init__(self, broadcast: Dict[str, Any]):
+        self.broadcast_id = broadcast["broadcast_id"]
+        self.chat_id = broadcast["chat_id"]
+        self.total = int(broadcast["total"])
+        self.sent = int(broadcast["sent"])
+        self.failed = int(broadcast["failed"])
+        self.blocked = int(broadcast["blocked"])
+        self.status = broadcast["status"]
+        self.started = time.monotonic()
+        self.processed_now = 0
+        # None — работаем; "cancel" — остановил админ; "shutdown" — остановка бота, продолжим после запуска
+        self.stop_reason: Optional[str] = None
+        self.message_id: Optional[int] = None
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.processed_now / elapsed if elapsed > 0 else 0.0
+
+    def add(self, results: List[Tuple[int, str, Optional[str]]]) -> None:
+        for _, status, _ in results:
+            if status == "sent":
+                self.sent += 1
+            elif status == "blocked":
+                self.blocked += 1
+            else:
+                self.failed += 1
+        self.processed_now += len(results)
+
+
+# Содержимое рассылки из сообщения админа: тип, file_id медиа и текст/подпись в HTML
+def content_from_message(message: Message) -> Optional[Dict[str, Any]]:
+    text = message.html_text if (message.text or message.caption) else None
+    if message.photo:
+        return {"kind": "photo", "file_id": message.photo[-1].file_id, "text": text}
+    if message.video:
+        return {"kind": "video", "file_id": message.video.file_id, "text": text}
+    if message.animation:
+        return {"kind": "animation", "file_id": message.animation.file_id, "text": text}
+    if message.document:
+        return {"kind": "document", "file_id": message.document.file_id, "text": text}
+    if message.text:
+        return {"kind": "text", "file_id": None, "text": text}
+    return None
+
+
+async def send_content(bot, chat_id: int, content: Dict[str, Any], **kwargs) -> Message:
+    kind = content.get("kind")
+    file_id = content.get("file_id")
+    text = content.get("text")
+    if kind == "photo":
+        return await bot.send_photo(chat_id, photo=file_id, caption=text, **kwargs)
+    if kind == "video":
+        return await bot.send_video(chat_id, video=file_id, caption=text, **kwargs)
+    if kind == "animation":
+        return await bot.send_animation(chat_id, animation=file_id, caption=text, **kwargs)
+    if kind == "document":
+        return await bot.send_document(chat_id, document=file_id, caption=text, **kwargs)
+    return await bot.send_message(chat_id, text or "", **kwargs)
+
+
+def format_progress(progress: BroadcastProgress) -> str:
+    lines = [
+        f"<b>Рассылка #{progress.broadcast_id}</b> — {STATUS_TITLES.get(progress.status, progress.status)}",
+        "",
+        f"Обработано: <b>{progress.done}</b> из {progress.total}",
+        f"Доставлено: {progress.sent}",
+        f"Заблокировали бота: {progress.blocked}",
+        f"Ошибки: {progress.failed}",
+    ]
+    rate = progress.rate
+    if progress.status == "running" and rate > 0:
+        left = max(progress.total - progress.done, 0)
+        lines.append(f"Скорость: {rate:.1f} сообщ./сек, осталось ~{int(left / rate)} сек")
+    return "\n".join(lines)
+
+
+def get_progress(broadcast_id: int) -> Optional[BroadcastProgress]:
+    return _progress.get(broadcast_id)
+
+
+async def _send_one(bot, user_id: int, content: Dict[str, Any]) -> Tuple[int, str, Optional[str]]:
+    try:
+        await send_content(bot, user_id, content)
+        return user_id, "sent", None
+    except TelegramForbiddenError as e:
+        return user_id, "blocked", str(e)
+    except Exception as e:
+        # TelegramRetryAfter сюда доходит, только если RateLimitMiddleware исчерпал повторы
+        return user_id, "failed", str(e)
+
+
+async def _report(bot, progress: BroadcastProgress, final: bool = False) -> None:
+    text = format_progress(progress)
+    markup = None if final else broadcast_progress_kb(progress.broadcast_id)
+    try:
+        if progress.message_id is None:
+            msg = await bot.send_message(progress.chat_id, text, reply_markup=markup)
+            progress.message_id = msg.message_id
+        else:
+            await bot.edit_message_text(
+                text, chat_id=progress.chat_id, message_id=progress.message_id, reply_markup=markup
+            )
+    except TelegramBadRequest as e:
+        if "not modified" not in str(e):
+            logging.warning("BROADCAST PROGRESS ERROR (#%s): %s", progress.broadcast_id, e)
+    except Exception:
+        logging.exception("BROADCAST PROGRESS ERROR (#%s)", progress.broadcast_id)
+
+
+async def _report_loop(bot, progress: BroadcastProgress) -> None:
+    while True:
+        await asyncio.sleep(broadcast_settings["progress_interval"])
+        await _report(bot, progress)
+
+
+async def _run(bot, broadcast: Dict[str, Any]) -> None:
+    broadcast_id = broadcast["broadcast_id"]
+    content = broadcast["content"]
+    progress = _progress[broadcast_id]
+    rate = max(broadcast_settings["rate"], 0.1)
+    bucket = TokenBucket(rate, rate)
+    await _report(bot, progress)
+    reporter = asyncio.create_task(_report_loop(bot, progress), name=f"broadcast-{broadcast_id}-progress")
+    try:
+        after_user_id = 0
+        while progress.stop_reason is None:
+            user_ids = await get_broadcast_recipients(broadcast_id, after_user_id, broadcast_settings["chunk_size"])
+            if not user_ids:
+                break
+            after_user_id = user_ids[-1]
+            sends: List[asyncio.Task] = []
+            for user_id in user_ids:
+                if progress.stop_reason is not None:
+                    break
+                await bucket.acquire()
+                sends.append(asyncio.create_task(_send_one(bot, user_id, content)))
+            # уже отправленные дожидаемся и записываем и при остановке — иначе после запуска они уйдут повторно
+            results = await asyncio.gather(*sends)
+            await save_broadcast_results(broadcast_id, results)
+            progress.add(results)
+
+        if progress.stop_reason == "shutdown":
+            # в базе остаётся running — resume_broadcasts продолжит
+            progress.status = "paused"
+            return
+        progress.status = "cancelled" if progress.stop_reason == "cancel" else "done"
+        await set_broadcast_status(broadcast_id, progress.status)
+        logging.info(
+            "Broadcast #%s %s: sent=%s blocked=%s failed=%s",
+            broadcast_id, progress.status, progress.sent, progress.blocked, progress.failed
+        )
+    except Exception:
+        logging.exception("BROADCAST ERROR (#%s)", broadcast_id)
+    finally:
+        reporter.cancel()
+        try:
+            await reporter
+        except asyncio.CancelledError:
+            pass
+        await _report(bot, progress, final=progress.status != "running")
+        _tasks.pop(broadcast_id, None)
+        _progress.pop(broadcast_id, None)
+
+
+async def start_broadcast(bot, broadcast_id: int) -> bool:
+    if broadcast_id in _tasks:
+        return False
+    broadcast = await get_broadcast(broadcast_id)
+    if not broadcast or broadcast["status"] != "running":
+        return False
+    _progress[broadcast_id] = BroadcastProgress(broadcast)
+    _tasks[broadcast_id] = asyncio.create_task(_run(bot, broadcast), name=f"broadcast-{broadcast_id}")
+    return True
+
+
+# Остановка админом: в этом процессе — после текущих отправок, иначе только статус в базе
+async def stop_broadcast(broadcast_id: int) -> None:
+    progress = _progress.get(broadcast_id)
+    if progress is not None:
+        progress.stop_reason = "cancel"
+        return
+    broadcast = await get_broadcast(broadcast_id)
+    if broadcast and broadcast["status"] == "running":
+        await set_broadcast_status(broadcast_id, "cancelled")
+
+
+async def resume_broadcasts(bot) -> None:
+    if not broadcast_settings["resume"]:
+        return
+    try:
+        for broadcast in await get_running_broadcasts():
+            if await start_broadcast(bot, broadcast["broadcast_id"]):
+                logging.info("Broadcast #%s resumed", broadcast["broadcast_id"])
+    except Exception:
+        logging.exception("BROADCAST RESUME ERROR")
+
+
+# При остановке бота: дописываем статусы начатых пачек, рассылка остаётся running и продолжится после запуска
+async def stop_broadcasts(timeout: float = 10.0) -> None:
+    if not _tasks:
+        return
+    for progress in _progress.values():
+        progress.stop_reason = progress.stop_reason or "shutdown"
+    tasks = list(_tasks.values())
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,45 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from create_bot import events_partition_settings
+from db_handler.db_funk import ensure_event_partitions, drop_expired_event_partitions
+
+_task: Optional[asyncio.Task] = None
+
+
+async def run_events_maintenance() -> Dict[str, List[str]]:
+    created = await ensure_event_partitions()
+    dropped = await drop_expired_event_partitions()
+    if created or dropped:
+        logging.info("EVENTS PARTITIONS: created=%s dropped=%s", created, dropped)
+    return {"created": created, "dropped": dropped}
+
+
+async def _maintenance_loop(interval: float) -> None:
+    while True:
+        try:
+            await run_events_maintenance()
+        except Exception:
+            logging.exception("EVENTS MAINTENANCE ERROR")
+        await asyncio.sleep(interval)
+
+
+def start_events_maintenance() -> None:
+    global _task
+    if _task is not None and not _task.done():
+        return
+    interval = max(float(events_partition_settings["check_hours"]), 0.1) * 3600
+    _task = asyncio.create_task(_maintenance_loop(interval), name="events-maintenance")
+
+
+async def stop_events_maintenance() -> None:
+    global _task
+    task, _task = _task, None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
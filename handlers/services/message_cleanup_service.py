@@ -0,0 +1,56 @@
+import asyncio
+import logging
+from typing import Iterable, List, Optional, Set
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+# Удаление старых сообщений экрана: пачками через deleteMessages (до 100 id за вызов),
+# при ошибке — одиночными delete_message параллельно. schedule_delete() не ждёт удаления,
+# чтобы новый экран отправлялся сразу.
+
+DELETE_BATCH_SIZE = 100
+
+_pending: Set[asyncio.Task] = set()
+
+
+async def _delete_one(bot, chat_id: int, message_id: int) -> None:
+    try:
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+    except (TelegramBadRequest, TelegramForbiddenError):
+        pass
+
+
+async def delete_messages(bot, chat_id: int, message_ids: Iterable[Optional[int]]) -> None:
+    ids: List[int] = list(dict.fromkeys(int(mid) for mid in message_ids if mid))
+    for i in range(0, len(ids), DELETE_BATCH_SIZE):
+        chunk = ids[i:i + DELETE_BATCH_SIZE]
+        try:
+            await bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+        except TelegramForbiddenError:
+            return
+        except Exception:
+            # например, часть сообщений старше 48 часов — удаляем по одному, что получится
+            await asyncio.gather(*(_delete_one(bot, chat_id, mid) for mid in chunk), return_exceptions=True)
+
+
+async def _run_delete(bot, chat_id: int, message_ids: List[Optional[int]]) -> None:
+    try:
+        await delete_messages(bot, chat_id, message_ids)
+    except Exception:
+        logging.exception("MESSAGE CLEANUP ERROR (chat %s)", chat_id)
+
+
+def schedule_delete(bot, chat_id: int, message_ids: Iterable[Optional[int]]) -> None:
+    ids = [mid for mid in message_ids if mid]
+    if not ids:
+        return
+    task = asyncio.create_task(_run_delete(bot, chat_id, ids))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+# При остановке бота даём запланированным удалениям завершиться
+async def wait_pending_deletes(timeout: float = 5.0) -> None:
+    if not _pending:
+        return
+    await asyncio.wait(list(_pending), timeout=timeout)
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+from typing import Dict, Optional
+
+import asyncpg
+
+from db_handler.db_funk import SETTINGS_CHANNEL, get_all_settings, set_setting
+from db_handler.db_pool import asyncpg_dsn
+
+# Настройки бота (bot_settings) в памяти процесса: чтение без обращения к БД.
+# Изменения приходят через LISTEN/NOTIFY на отдельном соединении, поэтому
+# переключение в админке сразу видно во всех процессах бота.
+
+KEEPALIVE_INTERVAL = 60
+RECONNECT_MAX_DELAY = 60
+
+_settings: Dict[str, str] = {}
+_task: Optional[asyncio.Task] = None
+
+
+async def load_settings() -> Dict[str, str]:
+    global _settings
+    _settings = await get_all_settings()
+    return _settings
+
+
+def get_cached_setting(key: str, default: str | None = None) -> str | None:
+    value = _settings.get(key)
+    return value if value is not None else default
+
+
+def is_maintenance_enabled() -> bool:
+    return get_cached_setting("maintenance", "0") == "1"
+
+
+async def update_setting(key: str, value: str) -> None:
+    await set_setting(key, value)
+    # свой процесс обновляем сразу, не дожидаясь уведомления
+    _settings[key] = value
+
+
+def _on_notify(connection, pid, channel, payload) -> None:
+    try:
+        data = json.loads(payload)
+        _settings[data["key"]] = data["value"]
+    except Exception:
+        logging.exception("SETTINGS NOTIFY PARSE ERROR: %r", payload)
+
+
+async def _listen_loop() -> None:
+    delay = 1
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(asyncpg_dsn())
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _: lost.set())
+            await conn.add_listener(SETTINGS_CHANNEL, _on_notify)
+            # уведомления, пришедшие пока соединения не было, потеряны — перечитываем всё
+            await load_settings()
+            delay = 1
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    await conn.execute("SELECT 1;")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("SETTINGS LISTENER ERROR")
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+
+async def start_settings_listener() -> None:
+    global _task
+    if _task is not None and not _task.done():
+        return
+    await load_settings()
+    _task = asyncio.create_task(_listen_loop(), name="settings-listener")
+
+
+async def stop_settings_listener() -> None:
+    global _task
+    task, _task = _task, None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import time
 import re
@@ -6,14 +7,10 @@ from datetime import datetime
 from typing import Dict, Any, List
 
 from db_handler.db_funk import (
-    get_user_count,
-    get_cases_count,
-    get_case_media_count,
-    get_events_total,
+    get_overview_counts,
     get_top_menu_clicks,
     get_top_cases,
-    get_funnel,
-    get_stuck_points,
+    get_funnel_report,
     get_recent_users,
 )
 
@@ -26,20 +23,29 @@ def _build_table_rows(rows: List[List[str]], colspan: int) -> str:
     )
 
 
+# Сколько запросов отчёта одновременно держат соединения из общего пула
+STATS_MAX_CONCURRENCY = 3
+
+
+async def _gather_bounded(*coros, limit: int = STATS_MAX_CONCURRENCY):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros))
+
+
 async def build_statistics_context() -> Dict[str, Any]:
-    users_total = await get_user_count()
-    cases_total = await get_cases_count()
-    cases_published = await get_cases_count(status="published")
-    cases_draft = await get_cases_count(status="draft")
-    cases_archived = await get_cases_count(status="archived")
-    media_total = await get_case_media_count()
-
-    events_total = await get_events_total(days=30)
-    top_menu = await get_top_menu_clicks(days=30, limit=15)
-    top_cases = await get_top_cases(days=30, limit=10)
-    funnel = await get_funnel(days=30)
-    stuck = await get_stuck_points(days=30, limit=10)
-    recent_users = await get_recent_users(limit=100)
+    # скалярные счётчики — одним запросом, списки — параллельно на соединениях пула
+    overview, top_menu, top_cases, funnel_report, recent_users = await _gather_bounded(
+        get_overview_counts(days=30),
+        get_top_menu_clicks(days=30, limit=15),
+        get_top_cases(days=30, limit=10),
+        get_funnel_report(days=30),
+        get_recent_users(limit=100),
+    )
 
     top_menu_rows: List[List[str]] = []
     for item in top_menu:
@@ -56,20 +62,23 @@ async def build_statistics_context() -> Dict[str, Any]:
         cnt = html.escape(str(item.get("cnt", 0)))
         top_cases_rows.append([title, cnt])
 
-    funnel_map = {row.get("event_type"): int(row.get("users", 0)) for row in funnel}
-    funnel_steps = [
-        ("start", "Старт"),
-        ("cases_open", "Открыли кейсы"),
-        ("case_view", "Открыли кейс"),
-        ("contact_open", "Открыли контакты"),
-    ]
+    funnel_labels = {
+        "start": "Старт",
+        "cases_open": "Открыли кейсы",
+        "case_view": "Открыли кейс",
+        "contact_open": "Открыли контакты",
+    }
     funnel_rows: List[List[str]] = []
-    for key, label in funnel_steps:
-        users = funnel_map.get(key, 0)
-        funnel_rows.append([html.escape(label), html.escape(str(users))])
+    for step in funnel_report["steps"]:
+        label = funnel_labels.get(step["event_type"], step["event_type"])
+        funnel_rows.append([
+            html.escape(label),
+            html.escape(str(step["users"])),
+            html.escape(str(step["ordered_users"])),
+        ])
 
     stuck_rows: List[List[str]] = []
-    for item in stuck:
+    for item in funnel_report["stuck"][:10]:
         label = html.escape(str(item.get("label", "")))
         users = html.escape(str(item.get("users", 0)))
         stuck_rows.append([label, users])
@@ -96,16 +105,16 @@ async def build_statistics_context() -> Dict[str, Any]:
 
     context = {
         "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M"),
-        "users_total": users_total,
-        "cases_total": cases_total,
-        "cases_published": cases_published,
-        "cases_draft": cases_draft,
-        "cases_archived": cases_archived,
-        "media_total": media_total,
-        "events_total": events_total,
+        "users_total": overview["users_total"],
+        "cases_total": overview["cases_total"],
+        "cases_published": overview["cases_published"],
+        "cases_draft": overview["cases_draft"],
+        "cases_archived": overview["cases_archived"],
+        "media_total": overview["media_total"],
+        "events_total": overview["events_total"],
         "top_buttons_rows": _build_table_rows(top_menu_rows, colspan=2),
         "top_cases_rows": _build_table_rows(top_cases_rows, colspan=2),
-        "funnel_rows": _build_table_rows(funnel_rows, colspan=2),
+        "funnel_rows": _build_table_rows(funnel_rows, colspan=3),
         "stuck_rows": _build_table_rows(stuck_rows, colspan=2),
         "users_rows": _build_table_rows(users_rows, colspan=4),
     }
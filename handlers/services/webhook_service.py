@@ -0,0 +1,117 @@
+import asyncio
+import hmac
+import logging
+import signal
+from typing import Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from create_bot import webhook_settings
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Приём обновлений вебхуком на aiohttp.
+    Ответ Telegram отдаётся сразу, обработка идёт фоновой задачей; одновременно
+    обрабатывается не больше max_in_flight обновлений — дальше запрос ждёт свободный слот.
+    Порядок внутри чата и предел одновременных обработчиков держит ChatOrderMiddleware
+    (middlewares/chat_order.py), поэтому max_in_flight — запас на ожидающие в очереди чата.
+    При остановке новые обновления получают 503 (Telegram пришлёт их повторно),
+    а начатые дорабатываются до drain_timeout секунд.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret: str, max_in_flight: int = 100):
+        if not secret:
+            raise ValueError("WebhookServer requires a non-empty secret")
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret = secret
+        self._slots = asyncio.Semaphore(max(int(max_in_flight), 1))
+        self._tasks: Set[asyncio.Task] = set()
+        self._closing = False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if self._closing:
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception:
+            logging.exception("WEBHOOK BAD UPDATE")
+            return web.Response(status=400)
+
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response(status=200)
+
+    async def _process(self, update: Update) -> None:
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        except Exception:
+            logging.exception("WEBHOOK UPDATE ERROR (update %s)", update.update_id)
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float) -> None:
+        self._closing = True
+        if not self._tasks:
+            return
+        logging.info("Webhook drain: waiting for %s updates", len(self._tasks))
+        done, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning("Webhook drain: %s updates cancelled after %ss", len(pending), timeout)
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot) -> None:
+    server = WebhookServer(
+        dispatcher,
+        bot,
+        secret=webhook_settings["secret"],
+        max_in_flight=webhook_settings["max_in_flight"],
+    )
+    app = web.Application()
+    app.router.add_post(webhook_settings["path"], server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=webhook_settings["host"], port=webhook_settings["port"])
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher)
+    try:
+        await site.start()
+        # при нескольких процессах за прокси вебхук регистрирует только один (WEBHOOK_SET=True)
+        if webhook_settings["set_webhook"]:
+            await bot.set_webhook(
+                url=webhook_settings["url"].rstrip("/") + webhook_settings["path"],
+                secret_token=webhook_settings["secret"],
+                allowed_updates=dispatcher.resolve_used_update_types(),
+                max_connections=min(int(webhook_settings["max_in_flight"]), 100),
+                # по умолчанию накопленное за перезапуск не выбрасываем — Telegram доставит его сюда
+                drop_pending_updates=webhook_settings["drop_pending"],
+            )
+        logging.info(
+            "Webhook server on %s:%s%s",
+            webhook_settings["host"], webhook_settings["port"], webhook_settings["path"]
+        )
+        await stop_event.wait()
+    finally:
+        # вебхук не снимаем: пока бот перезапускается, Telegram копит обновления у себя
+        await server.drain(webhook_settings["drain_timeout"])
+        await runner.cleanup()
+        await dispatcher.emit_shutdown(bot=bot, dispatcher=dispatcher)
@@ -1,20 +1,20 @@
 from aiogram import Router, F
 from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, FSInputFile, CallbackQuery, InputMediaPhoto, InputMediaVideo
+from aiogram.types import Message, CallbackQuery, InputMediaPhoto, InputMediaVideo
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from aiogram.utils.chat_action import ChatActionSender
 from aiogram.fsm.context import FSMContext
 from create_bot import bot, admins
-from db_handler.db_funk import get_user_data, insert_user, get_cases_page, get_case_by_id, get_case_images, log_event, get_setting, get_case_review, get_case_cta
+from db_handler.db_funk import register_user, get_cases_page, get_case_bundle_cached, log_event
+from handlers.services.settings_service import is_maintenance_enabled
+from handlers.services.message_cleanup_service import schedule_delete
+from handlers.services.assets_service import answer_asset_photo
 from keyboards.kbs import aboutMe_kb, main_kb, public_cases_kb, public_case_view_kb, public_review_view_kb, public_review_empty_kb, cantact_kb, steps_kb
 import random
-import time
 
 
 user_router = Router()
 PAGE_SIZE = 8
-MAINTENANCE_CACHE_TTL = 10
-_maintenance_cache = {"value": "0", "ts": 0.0}
 CTA_TEXTS = [
     "Начать работать со мной",
     "Хочу обсудить проект",
@@ -84,37 +84,13 @@ async def safe_log_event(user_id: int, event_type: str, event_context: str | Non
         pass
 
 
-async def is_maintenance_enabled() -> bool:
-    now_ts = time.monotonic()
-    if (now_ts - _maintenance_cache["ts"]) > MAINTENANCE_CACHE_TTL:
-        try:
-            value = await get_setting("maintenance", "0")
-        except Exception:
-            value = "0"
-        _maintenance_cache["value"] = value or "0"
-        _maintenance_cache["ts"] = now_ts
-    return _maintenance_cache["value"] == "1"
-
-
 async def cleanup_public_cases_view(state: FSMContext, bot, chat_id: int):
     data = await state.get_data()
     album_ids = data.get("public_case_album_ids", [])
     card_id = data.get("public_case_card_message_id")
 
-    for mid in album_ids:
-        try:
-            await bot.delete_message(chat_id=chat_id, message_id=mid)
-        except TelegramBadRequest:
-            pass
-        except Exception:
-            pass
-    if card_id:
-        try:
-            await bot.delete_message(chat_id=chat_id, message_id=card_id)
-        except TelegramBadRequest:
-            pass
-        except Exception:
-            pass
+    # удаление уходит в фон одним deleteMessages
+    schedule_delete(bot, chat_id, [*album_ids, card_id])
 
     await state.update_data(public_case_album_ids=[], public_case_card_message_id=None, last_case_cta_case_id=None)
 
@@ -124,40 +100,26 @@ async def cleanup_public_review_view(state: FSMContext, bot, chat_id: int):
     message_ids = data.get("public_review_message_ids", [])
     card_id = data.get("public_review_card_message_id")
 
-    for mid in message_ids:
-        try:
-            await bot.delete_message(chat_id=chat_id, message_id=mid)
-        except TelegramBadRequest:
-            pass
-        except Exception:
-            pass
-    if card_id:
-        try:
-            await bot.delete_message(chat_id=chat_id, message_id=card_id)
-        except TelegramBadRequest:
-            pass
-        except Exception:
-            pass
+    # удаление уходит в фон одним deleteMessages
+    schedule_delete(bot, chat_id, [*message_ids, card_id])
 
     await state.update_data(public_review_message_ids=[], public_review_card_message_id=None)
 
 
-async def render_public_case_list(message_obj, state: FSMContext, page: int):
-    cases = await get_cases_page(page=page, limit=PAGE_SIZE + 1, status="published")
-    has_next = len(cases) > PAGE_SIZE
-    cases = cases[:PAGE_SIZE]
-    has_prev = page > 0
+async def render_public_case_list(message_obj, state: FSMContext, cursor: str):
+    cases_page = await get_cases_page(cursor=cursor, limit=PAGE_SIZE, status="published")
 
-    photo = FSInputFile("src/images/cases.png")
+    photo = "src/images/cases.png"
     # пользователь | кейсы | показать список кейсов
-    await message_obj.answer_photo(
-        photo=photo,
+    await answer_asset_photo(
+        message_obj,
+        photo,
         caption="Кейсы",
         reply_markup=public_cases_kb(
-            cases=cases,
-            page=page,
-            has_prev=has_prev,
-            has_next=has_next
+            cases=cases_page["items"],
+            cursor=cases_page["cursor"],
+            prev_cursor=cases_page["prev_cursor"],
+            next_cursor=cases_page["next_cursor"]
         )
     )
 
@@ -165,14 +127,15 @@ async def render_public_case_list(message_obj, state: FSMContext, page: int):
 
 
 
-async def render_public_case_view(message_obj, state: FSMContext, case_id: int, back_page: int):
-    case = await get_case_by_id(case_id)
+async def render_public_case_view(message_obj, state: FSMContext, case_id: int, back_page: str):
+    bundle = await get_case_bundle_cached(case_id)
+    case = bundle["case"] if bundle else None
     if not case or case.get("status") != "published":
         # пользователь | просмотр кейса | кейс не найден
         await message_obj.answer("Кейс не найден")
         return
 
-    images = await get_case_images(case_id)
+    images = bundle["media"]
     if images:
         media = []
         for img in images[:10]:
@@ -186,16 +149,16 @@ async def render_public_case_view(message_obj, state: FSMContext, case_id: int,
         album_ids = [m.message_id for m in album_msgs]
         await state.update_data(public_case_album_ids=album_ids)
     else:
-        photo = FSInputFile("src/images/cases.png")
+        photo = "src/images/cases.png"
         # пользователь | просмотр кейса | показать заглушку 'Нет изображений'
-        msg = await message_obj.answer_photo(photo=photo, caption="Нет изображений")
+        msg = await answer_asset_photo(message_obj, photo, caption="Нет изображений")
         await state.update_data(public_case_album_ids=[msg.message_id])
 
     caption = f"<b>{case['title']}</b>\n\n{case['description']}"
     # пользователь | просмотр кейса | показать карточку кейса
     card_msg = await message_obj.answer(
         caption,
-        reply_markup=public_case_view_kb(case_id, back_page, await get_case_cta(case_id))
+        reply_markup=public_case_view_kb(case_id, back_page, bundle["cta"])
     )
     await state.update_data(public_case_card_message_id=card_msg.message_id)
     await state.update_data(last_case_cta_case_id=case_id)
@@ -203,10 +166,11 @@ async def render_public_case_view(message_obj, state: FSMContext, case_id: int,
 
 async def render_contact_screen(message_obj, user_id: int):
     await safe_log_event(user_id, "contact_open", "contact_page")
-    photo = FSInputFile("src/images/contact.png")
+    photo = "src/images/contact.png"
     # пользователь | контакт | показать экран контакта
-    await message_obj.answer_photo(
-        photo=photo,
+    await answer_asset_photo(
+        message_obj,
+        photo,
         caption=f"{contact_text}",
         reply_markup=cantact_kb()
     )
@@ -216,17 +180,18 @@ async def render_contact_screen(message_obj, user_id: int):
 async def cmd_start(message: Message):
     await safe_log_event(message.from_user.id, "start", "system", payload={"username": message.from_user.username, "full_name": message.from_user.full_name})
     async with ChatActionSender.typing(bot=bot, chat_id=message.chat.id):
-        await insert_user(user_data={
+        await register_user(user_data={
             'user_id': message.from_user.id,
             'full_name': message.from_user.full_name,
             'user_login': message.from_user.username,
         })
         response_text = ""
-        photo = FSInputFile("src/images/mainMenu.png")
+        photo = "src/images/mainMenu.png"
 
     # пользователь | главное меню | показать стартовый экран
-    await message.answer_photo(
-        photo=photo,
+    await answer_asset_photo(
+        message,
+        photo,
         caption=response_text,
         reply_markup=main_kb(message.from_user.id))
 
@@ -235,12 +200,13 @@ async def cmd_start(message: Message):
 @user_router.message(Command('restart'))
 async def restart(message: Message):
     response_text = ""
-    photo = FSInputFile("src/images/mainMenu.png")
+    photo = "src/images/mainMenu.png"
     await delete_event_message(message)
 
     # пользователь | главное меню | показать стартовый экран
-    await message.answer_photo(
-        photo=photo,
+    await answer_asset_photo(
+        message,
+        photo,
         caption=response_text,
         reply_markup=main_kb(message.from_user.id))
 
@@ -257,7 +223,7 @@ async def open_main_panel(callback: CallbackQuery, state: FSMContext):
 
     if callback.from_user.id not in admins:
         try:
-            if await is_maintenance_enabled():
+            if is_maintenance_enabled():
                 await safe_delete_event_message(callback)
                 # пользователь | сервис | уведомление: бот на обслуживании
                 await callback.message.answer("Бот на обслуживании, напишите @RuviconChief")
@@ -273,11 +239,12 @@ async def open_main_panel(callback: CallbackQuery, state: FSMContext):
 
     if action == "main":
         await safe_log_event(callback.from_user.id, "menu_open", "main_menu")
-        photo = FSInputFile("src/images/mainMenu.png")
+        photo = "src/images/mainMenu.png"
         await safe_delete_event_message(callback)
         # пользователь | главное меню | показать главное меню
-        await callback.message.answer_photo(
-            photo=photo,
+        await answer_asset_photo(
+            callback.message,
+            photo,
             caption="Главное меню",
             reply_markup=main_kb(callback.from_user.id)
         )
@@ -292,11 +259,12 @@ async def open_main_panel(callback: CallbackQuery, state: FSMContext):
 
     if action == "aboutMe":
         await safe_log_event(callback.from_user.id, "about_open", "about_page")
-        photo = FSInputFile("src/images/aboutMe.png")
+        photo = "src/images/aboutMe.png"
         await safe_delete_event_message(callback)
         # пользователь | о себе | показать страницу 'О себе'
-        await callback.message.answer_photo(
-            photo = photo,
+        await answer_asset_photo(
+            callback.message,
+            photo,
             caption = f"{aboutMe_text}",
             reply_markup = aboutMe_kb()
         )
@@ -308,23 +276,20 @@ async def open_main_panel(callback: CallbackQuery, state: FSMContext):
         payload = parts[3] if len(parts) > 3 else None
 
         if sub_action == "list":
-            try:
-                page = int(payload) if payload is not None else 0
-            except ValueError:
-                page = 0
-            await safe_log_event(callback.from_user.id, "cases_open", "cases_list", event_value=str(page), payload={"page": page})
+            cursor = payload or ""
+            await safe_log_event(callback.from_user.id, "cases_open", "cases_list", event_value=cursor, payload={"cursor": cursor})
             await safe_delete_event_message(callback)
             await cleanup_public_review_view(state, callback.bot, callback.message.chat.id)
-            await render_public_case_list(callback.message, state, page)
+            await render_public_case_list(callback.message, state, cursor)
             return
 
         if sub_action == "view":
-            back_page = 0
+            back_page = ""
             try:
                 if payload and "|" in payload:
                     case_id_str, back_page_str = payload.split("|", 1)
                     case_id = int(case_id_str)
-                    back_page = int(back_page_str)
+                    back_page = back_page_str
                 else:
                     case_id = int(payload) if payload is not None else 0
             except ValueError:
@@ -342,12 +307,12 @@ async def open_main_panel(callback: CallbackQuery, state: FSMContext):
             return
 
         if sub_action == "review":
-            back_page = 0
+            back_page = ""
             try:
                 if payload and "|" in payload:
                     case_id_str, back_page_str = payload.split("|", 1)
                     case_id = int(case_id_str)
-                    back_page = int(back_page_str)
+                    back_page = back_page_str
                 else:
                     case_id = int(payload) if payload is not None else 0
             except ValueError:
@@ -362,7 +327,8 @@ async def open_main_panel(callback: CallbackQuery, state: FSMContext):
             await cleanup_public_review_view(state, callback.bot, callback.message.chat.id)
             await safe_delete_event_message(callback)
 
-            review = await get_case_review(case_id)
+            bundle = await get_case_bundle_cached(case_id)
+            review = bundle["review"] if bundle else None
             if not review or not review.get("items"):
                 # пользователь | отзывы | показать сообщение: нет отзывов
                 msg = await callback.message.answer(
@@ -418,13 +384,13 @@ async def open_main_panel(callback: CallbackQuery, state: FSMContext):
             return
 
         if sub_action == "review_cta":
-            back_page = 0
+            back_page = ""
             cta_index = -1
             try:
                 if payload and "|" in payload:
                     case_id_str, back_page_str, cta_index_str = payload.split("|", 2)
                     case_id = int(case_id_str)
-                    back_page = int(back_page_str)
+                    back_page = back_page_str
                     cta_index = int(cta_index_str)
                 else:
                     case_id = int(payload) if payload is not None else 0
@@ -461,11 +427,12 @@ async def open_main_panel(callback: CallbackQuery, state: FSMContext):
 
     if action == "steps":
         await safe_log_event(callback.from_user.id, "steps_open", "steps_page")
-        photo = FSInputFile("src/images/workStep.png")
+        photo = "src/images/workStep.png"
         await safe_delete_event_message(callback)
         # пользователь | этапы | показать этапы работ
-        await callback.message.answer_photo(
-            photo = photo,
+        await answer_asset_photo(
+            callback.message,
+            photo,
             caption = f"{steps_text}",
             reply_markup = steps_kb()
         )
@@ -1,5 +1,14 @@
 import asyncio
-from db_handler.db_funk import create_table_users
+from db_handler.db_pool import close_pool
+from db_handler.migrations import apply_migrations
+
+
+async def main():
+    try:
+        await apply_migrations()
+    finally:
+        await close_pool()
+
 
 if __name__ == '__main__':
-    asyncio.run(create_table_users())
\ No newline at end of file
+    asyncio.run(main())
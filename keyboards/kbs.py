@@ -40,6 +40,7 @@ def admin_panel_kb(users_count: int) -> InlineKeyboardMarkup:
         ],
         [
             InlineKeyboardButton(text="Управление кейсами", callback_data="admin:cases"),
+            InlineKeyboardButton(text="Рассылка", callback_data="admin:broadcast"),
         ],
         [
             InlineKeyboardButton(text="← В главное меню", callback_data="menu:main"),
@@ -79,8 +80,40 @@ def settings_kb(maintenance_enabled: bool) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
+# ------------------------------------------------------------------------ Рассылка -----------------------------------------------------------------
+def broadcast_kb(running_id: int | None = None) -> InlineKeyboardMarkup:
+    kb = []
+    if running_id:
+        kb.append([
+            InlineKeyboardButton(text="🔄 Обновить", callback_data="admin:broadcast"),
+            InlineKeyboardButton(text="⏹ Остановить", callback_data=f"admin:broadcast:stop:{running_id}"),
+        ])
+    else:
+        kb.append([InlineKeyboardButton(text="✉️ Новая рассылка", callback_data="admin:broadcast:new")])
+    kb.append([InlineKeyboardButton(text="← Назад в админ-меню", callback_data="admin:main")])
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+
+def broadcast_progress_kb(broadcast_id: int) -> InlineKeyboardMarkup:
+    kb = [
+        [
+            InlineKeyboardButton(text="⏹ Остановить", callback_data=f"admin:broadcast:stop:{broadcast_id}"),
+        ]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+
+def broadcast_cancel_kb() -> InlineKeyboardMarkup:
+    kb = [
+        [
+            InlineKeyboardButton(text="✖️ Отмена", callback_data="admin:broadcast"),
+        ]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+
 # ------------------------------------------------------------------------ Инлайн создание кейса -----------------------------------------------------------------
-def admin_cases_kb(cases: Sequence[dict], page: int, has_prev: bool, has_next: bool,) -> InlineKeyboardMarkup:
+def admin_cases_kb(cases: Sequence[dict], cursor: str, prev_cursor: str | None, next_cursor: str | None) -> InlineKeyboardMarkup:
     kb: list[list[InlineKeyboardButton]] = [
         [InlineKeyboardButton(text="Создать кейс", callback_data="admin:cases:new")]
     ]
@@ -96,19 +129,19 @@ def admin_cases_kb(cases: Sequence[dict], page: int, has_prev: bool, has_next: b
         kb.append([
             InlineKeyboardButton(
                 text=f"{title}",
-                callback_data=f"admin:cases:view:{case_id}|{page}"
+                callback_data=f"admin:cases:view:{case_id}|{cursor}"
             )
         ])
 
     # пагинация
     nav_row: list[InlineKeyboardButton] = []
-    if has_prev and page > 0:
+    if prev_cursor is not None:
         nav_row.append(
-            InlineKeyboardButton(text="Назад", callback_data=f"admin:cases:list:{page-1}")
+            InlineKeyboardButton(text="Назад", callback_data=f"admin:cases:list:{prev_cursor}")
         )
-    if has_next:
+    if next_cursor is not None:
         nav_row.append(
-            InlineKeyboardButton(text="Вперёд", callback_data=f"admin:cases:list:{page+1}")
+            InlineKeyboardButton(text="Вперёд", callback_data=f"admin:cases:list:{next_cursor}")
         )
 
     if nav_row:
@@ -119,7 +152,7 @@ def admin_cases_kb(cases: Sequence[dict], page: int, has_prev: bool, has_next: b
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
-def admin_case_editor_kb(case_id: int, status: str, back_page: int = 0) -> InlineKeyboardMarkup:
+def admin_case_editor_kb(case_id: int, status: str, back_page: str = "") -> InlineKeyboardMarkup:
     kb = [
         [
             InlineKeyboardButton(
@@ -173,7 +206,7 @@ def admin_case_editor_kb(case_id: int, status: str, back_page: int = 0) -> Inlin
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
-def admin_cancel_case_edit_kb(case_id: int, back_page: int = 0, show_done: bool = False) -> InlineKeyboardMarkup:
+def admin_cancel_case_edit_kb(case_id: int, back_page: str = "", show_done: bool = False) -> InlineKeyboardMarkup:
     row = [
         InlineKeyboardButton(
             text="✖️ Отмена",
@@ -190,7 +223,7 @@ def admin_cancel_case_edit_kb(case_id: int, back_page: int = 0, show_done: bool
     return InlineKeyboardMarkup(inline_keyboard=[row])
 
 
-def admin_cancel_review_edit_kb(case_id: int, back_page: int = 0, show_done: bool = False) -> InlineKeyboardMarkup:
+def admin_cancel_review_edit_kb(case_id: int, back_page: str = "", show_done: bool = False) -> InlineKeyboardMarkup:
     row = [
         InlineKeyboardButton(
             text="✖️ Отмена",
@@ -207,7 +240,7 @@ def admin_cancel_review_edit_kb(case_id: int, back_page: int = 0, show_done: boo
     return InlineKeyboardMarkup(inline_keyboard=[row])
 
 
-def admin_cancel_cta_edit_kb(case_id: int, back_page: int = 0) -> InlineKeyboardMarkup:
+def admin_cancel_cta_edit_kb(case_id: int, back_page: str = "") -> InlineKeyboardMarkup:
     row = [
         InlineKeyboardButton(
             text="✖️ Отмена",
@@ -217,7 +250,7 @@ def admin_cancel_cta_edit_kb(case_id: int, back_page: int = 0) -> InlineKeyboard
     return InlineKeyboardMarkup(inline_keyboard=[row])
 
 
-def admin_cta_type_kb(case_id: int, back_page: int = 0) -> InlineKeyboardMarkup:
+def admin_cta_type_kb(case_id: int, back_page: str = "") -> InlineKeyboardMarkup:
     kb = [
         [
             InlineKeyboardButton(
@@ -234,7 +267,7 @@ def admin_cta_type_kb(case_id: int, back_page: int = 0) -> InlineKeyboardMarkup:
 
 
 # ------------------------------------------------------------------------ Публичные кейсы -----------------------------------------------------------------
-def public_cases_kb(cases: Sequence[dict], page: int, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+def public_cases_kb(cases: Sequence[dict], cursor: str, prev_cursor: str | None, next_cursor: str | None) -> InlineKeyboardMarkup:
     kb: list[list[InlineKeyboardButton]] = []
 
     for c in cases:
@@ -245,18 +278,18 @@ def public_cases_kb(cases: Sequence[dict], page: int, has_prev: bool, has_next:
         kb.append([
             InlineKeyboardButton(
                 text=f"{title}",
-                callback_data=f"menu:cases:view:{case_id}|{page}"
+                callback_data=f"menu:cases:view:{case_id}|{cursor}"
             )
         ])
 
     nav_row: list[InlineKeyboardButton] = []
-    if has_prev and page > 0:
+    if prev_cursor is not None:
         nav_row.append(
-            InlineKeyboardButton(text="Назад", callback_data=f"menu:cases:list:{page-1}")
+            InlineKeyboardButton(text="Назад", callback_data=f"menu:cases:list:{prev_cursor}")
         )
-    if has_next:
+    if next_cursor is not None:
         nav_row.append(
-            InlineKeyboardButton(text="Дальше", callback_data=f"menu:cases:list:{page+1}")
+            InlineKeyboardButton(text="Дальше", callback_data=f"menu:cases:list:{next_cursor}")
         )
     if nav_row:
         kb.append(nav_row)
@@ -266,7 +299,7 @@ def public_cases_kb(cases: Sequence[dict], page: int, has_prev: bool, has_next:
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
-def public_case_view_kb(case_id: int, back_page: int, cta_button: dict | None = None) -> InlineKeyboardMarkup:
+def public_case_view_kb(case_id: int, back_page: str, cta_button: dict | None = None) -> InlineKeyboardMarkup:
     button_text = "Связаться со мной"
     action_type = "contact"
     action_value = None
@@ -293,7 +326,7 @@ def public_case_view_kb(case_id: int, back_page: int, cta_button: dict | None =
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
-def public_review_view_kb(case_id: int, back_page: int, cta_text: str, cta_index: int) -> InlineKeyboardMarkup:
+def public_review_view_kb(case_id: int, back_page: str, cta_text: str, cta_index: int) -> InlineKeyboardMarkup:
     kb = [
         [
             InlineKeyboardButton(
@@ -312,7 +345,7 @@ def public_review_view_kb(case_id: int, back_page: int, cta_text: str, cta_index
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
-def public_review_empty_kb(case_id: int, back_page: int) -> InlineKeyboardMarkup:
+def public_review_empty_kb(case_id: int, back_page: str) -> InlineKeyboardMarkup:
     kb = [
         [
             InlineKeyboardButton(text="← Вернуться к кейсу", callback_data=f"menu:cases:view:{case_id}|{back_page}"),
@@ -0,0 +1,71 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.types import TelegramObject
+
+
+class _ChatQueue:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # обновления чата в работе и в ожидании; 0 — очередь удаляется
+        self.users = 0
+
+
+class ChatOrderMiddleware(BaseMiddleware):
+    """
+    Обновления одного чата обрабатываются по очереди в порядке прихода, разных чатов —
+    параллельно, но одновременно не больше max_concurrency обработчиков на процесс.
+    Два быстрых нажатия одного пользователя больше не гоняются за FSM-данными
+    (id сообщений для очистки экрана), а общий лимит не даёт пику съесть пул БД.
+    Работает и для polling, и для вебхука: оба идут через dp.feed_update.
+    Регистрируется первым в dp.update.outer_middleware — до FSMSnapshotMiddleware,
+    чтобы снимок FSM читался уже после предыдущего обновления чата.
+    """
+
+    def __init__(self, max_concurrency: int = 50):
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._chats: Dict[int, _ChatQueue] = {}
+
+    @staticmethod
+    def _chat_key(data: Dict[str, Any]) -> Optional[int]:
+        chat = data.get("event_chat")
+        if chat is not None:
+            return chat.id
+        user = data.get("event_from_user")
+        return user.id if user is not None else None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat_key = self._chat_key(data)
+        if chat_key is None:
+            async with self._slots:
+                return await handler(event, data)
+
+        queue = self._chats.get(chat_key)
+        if queue is None:
+            queue = self._chats[chat_key] = _ChatQueue()
+        queue.users += 1
+        try:
+            waited = queue.lock.locked()
+            # asyncio.Lock отдаётся ожидающим по порядку — обновления чата идут в порядке прихода
+            async with queue.lock:
+                if waited:
+                    # состояние прочитано встроенным FSM-мидлварем до ожидания — предыдущее обновление могло его сменить
+                    state = data.get("state")
+                    if isinstance(state, FSMContext):
+                        data["raw_state"] = await state.get_state()
+                async with self._slots:
+                    return await handler(event, data)
+        finally:
+            queue.users -= 1
+            if queue.users == 0:
+                self._chats.pop(chat_key, None)
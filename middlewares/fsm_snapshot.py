@@ -0,0 +1,101 @@
+import copy
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType
+from aiogram.types import TelegramObject
+
+_UNSET = object()
+
+
+class SnapshotFSMContext(FSMContext):
+    """
+    FSMContext на время одного обновления: данные читаются из хранилища один раз,
+    get_data/update_data/set_state работают с копией в памяти, а изменения
+    записываются одним вызовом flush() в конце обновления.
+    Хранилище повторно не читается: данные сравниваются с копией, снятой при загрузке,
+    и пишутся, только если изменились. Обновления одного чата идут по очереди
+    (ChatOrderMiddleware), а запись из другого процесса отсекает проверка версии в PgStorage.
+    """
+
+    def __init__(self, context: FSMContext, raw_state: Any = _UNSET):
+        super().__init__(storage=context.storage, key=context.key)
+        self._data: Optional[Dict[str, Any]] = None
+        # данные в том виде, в каком они лежат в хранилище; None — ещё не читали
+        self._stored: Optional[Dict[str, Any]] = None
+        self._changed: Set[str] = set()
+        self._replaced = False
+        self._state = raw_state
+        self._state_dirty = False
+
+    async def _snapshot(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = await self.storage.get_data(key=self.key)
+            self._stored = copy.deepcopy(self._data)
+        return self._data
+
+    async def get_state(self) -> Optional[str]:
+        if self._state is _UNSET:
+            self._state = await self.storage.get_state(key=self.key)
+        return self._state
+
+    async def set_state(self, state: StateType = None) -> None:
+        self._state = state.state if isinstance(state, State) else state
+        self._state_dirty = True
+
+    async def get_data(self) -> Dict[str, Any]:
+        return dict(await self._snapshot())
+
+    async def get_value(self, key: str, default: Optional[Any] = None) -> Optional[Any]:
+        return (await self._snapshot()).get(key, default)
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        self._data = dict(data)
+        self._replaced = True
+
+    async def update_data(self, data: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        snapshot = await self._snapshot()
+        changes = dict(data or {}, **kwargs)
+        snapshot.update(changes)
+        self._changed.update(changes)
+        return dict(snapshot)
+
+    async def clear(self) -> None:
+        await self.set_state(None)
+        await self.set_data({})
+
+    async def flush(self) -> None:
+        if self._state_dirty:
+            await self.storage.set_state(key=self.key, state=self._state)
+            self._state_dirty = False
+        if (self._replaced or self._changed) and self._data != self._stored:
+            await self.storage.set_data(key=self.key, data=self._data)
+            self._stored = copy.deepcopy(self._data)
+        self._replaced = False
+        self._changed.clear()
+
+
+class FSMSnapshotMiddleware(BaseMiddleware):
+    """
+    Подменяет state в обработчиках на SnapshotFSMContext: одно чтение FSM-данных
+    и одна запись на обновление вместо обращения к хранилищу на каждый get_data/update_data.
+    Регистрируется после встроенного FSM-мидлвари диспетчера (dp.update.outer_middleware).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        state = data.get("state")
+        if not isinstance(state, FSMContext):
+            return await handler(event, data)
+        snapshot = SnapshotFSMContext(state, raw_state=data.get("raw_state", _UNSET))
+        data["state"] = snapshot
+        try:
+            return await handler(event, data)
+        finally:
+            await snapshot.flush()
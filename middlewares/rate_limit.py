@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Корзина токенов: rate токенов в секунду, не больше capacity подряд.
+    acquire() ждёт своей очереди (asyncio.Lock отдаёт его по порядку ожидания),
+    block() запрещает выдачу на время retry_after от Telegram.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(float(rate), 0.001)
+        self.capacity = max(float(capacity), 1.0)
+        self._tokens = self.capacity
+        self._ts = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        self.last_used = self._ts
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate)
+                self._ts = now
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self.last_used = now
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    def block(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Исходящие вызовы Bot API, отправляющие или меняющие сообщения, проходят через
+    общую корзину (лимит бота) и корзину чата (личный чат / группа), поэтому в пик
+    они ставятся в очередь, а не падают с flood-ошибкой. На TelegramRetryAfter
+    чат (или весь бот, если чат неизвестен) ставится на паузу, и вызов повторяется.
+    """
+
+    LIMITED_PREFIXES = ("send", "copy", "forward", "edit")
+    # не сообщения: в лимиты Telegram на сообщения не входят и не должны тратить токены чата
+    EXEMPT_METHODS = frozenset({"sendChatAction"})
+
+    def __init__(
+        self,
+        global_rate: float = 25.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 10.0,
+        group_rate: float = 20 / 60,
+        group_burst: float = 3.0,
+        max_retries: int = 3,
+        max_chats: int = 10000,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max(int(max_retries), 0)
+        self.max_chats = max(int(max_chats), 1)
+        self._chats: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self._chats.get(key)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or int(chat_id) < 0
+            bucket = TokenBucket(
+                self.group_rate if is_group else self.chat_rate,
+                self.group_burst if is_group else self.chat_burst,
+            )
+            self._chats[key] = bucket
+            self._prune()
+        else:
+            self._chats.move_to_end(key)
+        return bucket
+
+    def _prune(self) -> None:
+        # выбрасываем давно не использованные корзины (они уже полные — состояние не теряется)
+        while len(self._chats) > self.max_chats:
+            key, bucket = next(iter(self._chats.items()))
+            if bucket._lock.locked():
+                self._chats.move_to_end(key)
+                return
+            del self._chats[key]
+
+    def _is_limited(self, method: TelegramMethod) -> bool:
+        name = getattr(method, "__api_method__", "") or ""
+        return name.startswith(self.LIMITED_PREFIXES) and name not in self.EXEMPT_METHODS
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not self._is_limited(method):
+            return await make_request(bot, method)
+
+        chat_id: Optional[Any] = getattr(method, "chat_id", None)
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        attempt = 0
+        while True:
+            # сначала очередь чата, потом общая — медленный чат не держит общий лимит
+            if chat_bucket is not None:
+                await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(
+                    "Flood control on %s (chat %s): retry after %ss, attempt %s",
+                    method.__api_method__, chat_id, e.retry_after, attempt
+                )
+                (chat_bucket or self.global_bucket).block(e.retry_after)
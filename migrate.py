@@ -0,0 +1,31 @@
+import argparse
+import asyncio
+from db_handler.db_pool import close_pool
+from db_handler.migrations import LATEST_VERSION, apply_migrations, get_migrations_status
+
+
+# Применение миграций схемы до деплоя:
+#   python migrate.py            — применить все недостающие шаги
+#   python migrate.py --to 1     — применить шаги до версии 1 включительно
+#   python migrate.py --status   — показать применённые и ожидающие шаги
+async def main(args: argparse.Namespace) -> None:
+    try:
+        if args.status:
+            for item in await get_migrations_status():
+                mark = "x" if item["applied"] else " "
+                print(f"[{mark}] {item['version']:04d} {item['description']}")
+            return
+        applied = await apply_migrations(args.to)
+        if applied:
+            print(f"Applied: {', '.join(str(v) for v in applied)}")
+        else:
+            print("Schema is up to date")
+    finally:
+        await close_pool()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("--status", action="store_true", help="показать состояние миграций")
+    parser.add_argument("--to", type=int, default=None, help=f"целевая версия (по умолчанию {LATEST_VERSION})")
+    asyncio.run(main(parser.parse_args()))